@@ -0,0 +1,261 @@
+""" Tracker benchmark suite
+
+Runs Tracker.receive over standard synthetic workloads and reports
+frames/sec, per-frame latency percentiles and objects retained per frame
+
+    python benchmark.py [--frames N] [--output results.json] [--compare old.json]
+    python benchmark.py --check-batch
+
+Results are saved as JSON (tagged with the current git commit) so
+runs of different commits can be compared with --compare
+
+--check-batch verifies that Tracker.receive_batch gives the same results
+as per-report Tracker.receive, across camera rotations, dropout and
+spurious sources
+"""
+import os
+import sys
+import gc
+import json
+import argparse
+import platform
+import subprocess
+import time as clock
+from datetime import datetime
+
+import simulator
+cwiid = simulator.install()
+
+import numpy as np
+
+import logger as logging
+import recording
+from tracker import Tracker
+
+timer = getattr(clock, 'perf_counter', clock.time)
+
+STEADY_PHASES = (('calibration', 0.1), ('rest', 60.0))
+RAPID_PHASES = (('calibration', 0.05), ('approach', 0.1), ('shot', 0.1), ('rest', 0.05))
+
+
+def idle_stream(frames, rate=100.0):
+    """ nothing in front of the camera, tracker waiting for calibration """
+    for frame in range(frames):
+        yield frame / rate, [None] * simulator.IR_SLOTS
+
+
+WORKLOADS = {
+    'idle': lambda frames: idle_stream(frames),
+    'steady_tracking': lambda frames: simulator.swing_stream(
+        swings=frames, phases=STEADY_PHASES, seed=0),
+    'rapid_shots': lambda frames: simulator.swing_stream(
+        swings=frames, phases=RAPID_PHASES, seed=0),
+    'heavy_dropout': lambda frames: simulator.swing_stream(
+        swings=frames, dropout=0.3, seed=0),
+    'spurious_sources': lambda frames: simulator.swing_stream(
+        swings=frames, spurious=0.8, noise=3.0, seed=0),
+}
+
+
+CHECK_ROTATIONS = (0, 90, 180)
+CHECK_STREAMS = {
+    'clean': {},
+    'dropout': {'dropout': 0.3},
+    'spurious': {'spurious': 0.8, 'noise': 3.0},
+}
+
+
+def new_tracker(camera_rotation=0):
+    return Tracker(cwiid.IR_Y_MAX*0.9, puck_proximity=25, stick_height=150,
+        camera_rotation=camera_rotation, log_level=logging.OFF)
+
+
+def load_workload(name, frames):
+    stream = WORKLOADS[name](frames)
+    return [next(stream) for _ in range(frames)]
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run_workload(reports):
+    """ times every Tracker.receive call of reports """
+    tracker = new_tracker()
+    latencies = [0.0] * len(reports)
+
+    gc.collect()
+    start = timer()
+    for (i, (time, sources)) in enumerate(reports):
+        t0 = timer()
+        tracker.receive(sources, time)
+        latencies[i] = timer() - t0
+    elapsed = timer() - start
+
+    latencies.sort()
+
+    return {
+        'frames': len(reports),
+        'frames_per_sec': len(reports) / elapsed,
+        'latency_p50_us': percentile(latencies, 0.50) * 1e6,
+        'latency_p99_us': percentile(latencies, 0.99) * 1e6,
+        'latency_max_us': latencies[-1] * 1e6,
+        'gc_objects_retained_per_frame': retained_per_frame(reports),
+        'shots': tracker.shoot_counter,
+    }
+
+
+def retained_per_frame(reports):
+    """
+    Mean growth of the gen-0 garbage collector count per Tracker.receive
+    call, measured on a separate untimed pass with collection disabled
+
+    The count goes up on every container allocation (lists, tuples,
+    instances...) and down on every deallocation, so this is the net
+    number of objects a call leaves alive, not its allocation churn
+    """
+    tracker = new_tracker()
+    retained = 0
+
+    gc.collect()
+    gc.disable()
+    try:
+        for (time, sources) in reports:
+            before = gc.get_count()[0]
+            tracker.receive(sources, time)
+            retained += gc.get_count()[0] - before
+    finally:
+        gc.enable()
+
+    return retained / float(len(reports))
+
+
+def as_records(reports):
+    """ (time, cwiid sources) reports as capture records, see recording """
+    records = np.zeros(len(reports), dtype=recording.RECORD_DTYPE)
+
+    for (record, (time, sources)) in zip(records, reports):
+        record['time'] = time
+        for (i, source) in enumerate(sources[:recording.IR_SLOTS]):
+            if source is not None:
+                record['valid'][i] = 1
+                record['pos'][i] = source['pos']
+                record['size'][i] = source['size']
+
+    return records
+
+
+def receive_results(tracker, records):
+    """ per-report receive, results in the format of Tracker.receive_batch """
+    states, touching_points, shots = [], [], []
+
+    for (i, record) in enumerate(records):
+        state, shoot_counter = tracker.state, tracker.shoot_counter
+        tracker.receive(recording.as_mesg_sources(record), float(record['time']))
+
+        if tracker.shoot_counter > shoot_counter:
+            shots.append((i, 'end'))
+        elif tracker.state == 'S' and state != 'S':
+            shots.append((i, 'start'))
+
+        states.append(tracker.state)
+        touching_points.append(tracker.touching_point)
+
+    return states, touching_points, shots
+
+
+def check_batch(swings=20):
+    """
+    Runs Tracker.receive_batch and per-report Tracker.receive over the
+    same sessions, returns the (rotation, stream) pairs whose results differ
+    """
+    mismatches = []
+
+    for rotation in CHECK_ROTATIONS:
+        for (name, options) in sorted(CHECK_STREAMS.items()):
+            records = as_records(list(simulator.swing_stream(
+                swings=swings, camera_rotation=rotation, seed=0, **options)))
+
+            tracker = new_tracker(rotation)
+            expected = receive_results(tracker, records)
+
+            batch_tracker = new_tracker(rotation)
+            states, touching_points, shots = batch_tracker.receive_batch(*recording.as_frames(records))
+
+            touching_points = [None if masked else tuple(point) for (point, masked)
+                in zip(touching_points.data.tolist(), touching_points.mask.any(axis=1).tolist())]
+
+            if (expected != (states.tolist(), touching_points, shots)
+                    or (tracker.shoot_counter, tracker.lose_counter, tracker.session_time())
+                        != (batch_tracker.shoot_counter, batch_tracker.lose_counter,
+                            batch_tracker.session_time())):
+                mismatches.append((rotation, name))
+
+    return mismatches
+
+
+def git_commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=devnull).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    for (name, metrics) in sorted(results['workloads'].items()):
+        old = baseline['workloads'].get(name)
+        if old is None:
+            continue
+        sys.stdout.write("%-18s frames/s %+.1f%%  p99 %+.1f%%\n" % (name,
+            100.0 * (metrics['frames_per_sec'] / old['frames_per_sec'] - 1),
+            100.0 * (metrics['latency_p99_us'] / old['latency_p99_us'] - 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tracker benchmark suite")
+    parser.add_argument('--frames', type=int, default=20000,
+        help="reports per workload")
+    parser.add_argument('--workload', action='append', choices=sorted(WORKLOADS),
+        help="run only the given workload(s)")
+    parser.add_argument('--output', help="save results as JSON")
+    parser.add_argument('--compare', help="JSON results of a previous run")
+    parser.add_argument('--check-batch', action='store_true',
+        help="only check receive_batch against per-report receive")
+    args = parser.parse_args()
+
+    if args.check_batch:
+        mismatches = check_batch()
+        for (rotation, name) in mismatches:
+            sys.stdout.write("receive_batch differs from receive: rotation %d, %s\n" % (rotation, name))
+        sys.stdout.write("receive_batch check %s\n" % ('failed' if mismatches else 'passed'))
+        sys.exit(1 if mismatches else 0)
+
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'date': datetime.now().isoformat(),
+        'workloads': {},
+    }
+
+    sys.stdout.write("%-18s %10s %9s %9s %9s %8s\n" % (
+        'workload', 'frames/s', 'p50 us', 'p99 us', 'max us', 'retained'))
+
+    for name in (args.workload or sorted(WORKLOADS)):
+        metrics = run_workload(load_workload(name, args.frames))
+        results['workloads'][name] = metrics
+
+        sys.stdout.write("%-18s %10.0f %9.1f %9.1f %9.1f %8.3f\n" % (name,
+            metrics['frames_per_sec'], metrics['latency_p50_us'],
+            metrics['latency_p99_us'], metrics['latency_max_us'],
+            metrics['gc_objects_retained_per_frame']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+main() if __name__ == '__main__' else True
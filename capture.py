@@ -1,15 +1,38 @@
+import sys
+import signal
+import threading
+import time as clock
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
 import cwiid
 wiimote = None
+wiimote_failed = threading.Event() # set by high_callback's default error handler
+
+import logger as logging
+logger = logging.Logger()
 
 from tracker import Tracker
+from recording import IRRecorder
 
 POINTS_TO_BE_TRACKED = 1
 
-def get_wiimote():
+def get_wiimote(factory=None):
+    """
+    factory: optional device constructor (e.g. a simulator.SimulatedWiimote
+        builder), defaults to cwiid.Wiimote
+    """
     global wiimote
-    print("Looking for Wiimote \n Put it in discoverable mode (sync button) then press 1+2 ...")
-    wiimote = cwiid.Wiimote()
+    logger.info("Looking for Wiimote \n Put it in discoverable mode (sync button) then press 1+2 ...")
+    wiimote = configure_wiimote((factory or cwiid.Wiimote)())
 
+    return wiimote
+
+def configure_wiimote(wiimote):
+    """ enables IR reports through the message callback interface """
     # defaults
     rumble=0
     rpt_mode=0 ; rpt_mode ^= cwiid.RPT_IR
@@ -22,35 +45,132 @@ def get_wiimote():
 
     return wiimote
 
-def high_callback(ir_callback):
+def high_callback(ir_callback, recorder=None, on_error=None):
+    """
+    recorder: optional recording.IRRecorder, receives every raw IR message
+    on_error: optional handler for cwiid.MESG_ERROR messages,
+        by default wiimote_failed is set, the device owner closes it
+        (closing joins cwiid's thread, so never from this callback)
+    """
     def cb(mesg_list, time):
         for mesg in mesg_list:
             if mesg[0] == cwiid.MESG_IR:
+                if recorder is not None:
+                    recorder.record(mesg, time)
                 ir_callback(mesg, time)
 
+            elif mesg[0] ==  cwiid.MESG_ERROR and on_error is not None:
+                on_error(mesg, time)
+
             elif mesg[0] ==  cwiid.MESG_ERROR:
-                print "Error message received from Wiimote callback!! Exiting"
-                global wiimote
-                wiimote.close()
-                exit(-1)
+                logger.error("Error message received from Wiimote callback!!")
+                wiimote_failed.set()
             else:
-                print 'Unknown Report'
+                logger.warning('Unknown Report')
     return cb
 
-def main():
-    get_wiimote()
+class CaptureRunner():
+    """
+    Event-driven capture session
 
-    global wiimote
+    run() connects to a Wiimote and then sleeps on an event queue,
+    callbacks do all the work in cwiid's thread:
+        - device errors close the device and reconnect (if enabled)
+        - stop() (or SIGINT / SIGTERM) ends the session, it only sets
+          a flag so it is safe in a signal handler
+    """
+    def __init__(self, ir_callback, factory=None, recorder=None,
+        reconnect=True, retry_interval=1.0, poll_interval=1.0):
+        self.ir_callback = ir_callback
+        self.factory = factory
+        self.recorder = recorder
+
+        self.reconnect = reconnect
+        self.retry_interval = retry_interval
+        self.poll_interval = poll_interval # bounds Ctrl+C latency on Python 2
+
+        self.events = queue.Queue()
+        self.stopping = False
+        self.device = None
+
+    def connect(self):
+        while not self.stopping:
+            try:
+                device = get_wiimote(self.factory)
+            except RuntimeError as e:
+                logger.warning("Could not connect to Wiimote (%s), retrying", e)
+                self._wait(self.retry_interval)
+                continue
+
+            device.mesg_callback = high_callback(self.ir_callback,
+                recorder=self.recorder, on_error=self.device_error)
+            logger.info("wiimote pegadinho")
+
+            return device
+
+        return None
+
+    def device_error(self, mesg, time):
+        self.events.put(('error', time))
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def run(self):
+        if threading.current_thread().name == 'MainThread':
+            signal.signal(signal.SIGINT, self.stop)
+            signal.signal(signal.SIGTERM, self.stop)
+
+        self.device = self.connect()
+
+        while self.device is not None and not self.stopping:
+            event = self._wait()
+
+            if event == 'error':
+                logger.error("Error message received from Wiimote callback!! Disconnecting")
+                self._close()
+
+                if self.reconnect:
+                    self._wait(self.retry_interval)
+                    self.device = self.connect()
+
+        self._close()
+
+    """ Internal Methods """
+    def _wait(self, timeout=None):
+        """ blocks until the next event (or timeout), returns its kind """
+        deadline = clock.time() + timeout if timeout is not None else None
+
+        while deadline is None or clock.time() < deadline:
+            if self.stopping:
+                return 'stop'
+
+            wait = self.poll_interval if deadline is None else \
+                min(self.poll_interval, max(0, deadline - clock.time()))
+            try:
+                event, _ = self.events.get(timeout=wait)
+            except queue.Empty:
+                continue
+
+            return event
+
+        return None
+
+    def _close(self):
+        if self.device is not None:
+            self.device.close()
+            self.device = None
 
+def main(record_path=None):
     tracker = Tracker(POINTS_TO_BE_TRACKED, (0,0))
 
-    wiimote.mesg_callback = high_callback(lambda mesg, time: tracker.receive(mesg[1], time))
+    recorder = IRRecorder(record_path) if record_path is not None else None
 
-    print("wiimote pegadinho")
+    runner = CaptureRunner(lambda mesg, time: tracker.receive(mesg[1], time), recorder=recorder)
+    runner.run()
 
-    ''' 'infinite' loop just to keep connection alive, callback handles data '''
-    while 1:
-        pass
+    if recorder is not None:
+        recorder.close()
 
 if __name__ == '__main__':
-    main()
+    main(*sys.argv[1:2])
@@ -2,6 +2,7 @@ from __future__ import absolute_import
 
 import os
 import sys
+import threading
 
 import copy
 from datetime import datetime
@@ -17,11 +18,13 @@ import numpy as np
 
 import cwiid
 
-from interface_utils import cv_image2texture, create_empty_texture
+from interface_utils import StreamingTexture
 from capture import get_wiimote, high_callback
 wiimote = None
 
 from tracker import Tracker
+from session_log import open_session_log, FREE_SHOOT, SHOOT_TEN
+import logger as logging
 
 __CONFIG = {
 
@@ -31,6 +34,16 @@ __CONFIG = {
 
     'CAMERA_ROTATION': 180,
 
+    'SESSION_LOG_FORMAT': 'text', # 'text' (.test) or 'binary' (.hsl)
+    'TRAJECTORY_FORMAT': None, # None, 'npy' (.traj directory) or 'npz'
+    'SESSION_LOG_ROTATE_BYTES': None, # text logs continue in .test.1, .test.2...
+    'SESSION_LOG_COMPRESS': False, # gzip text logs
+
+    'SHOOTING_VIEW_RENDER': 'vector', # 'vector' (imgui draw lists) or 'raster' (OpenCV + texture)
+    'TEXTURE_PBO': False, # streams the raster shooting view through pixel buffer objects
+
+    'MAX_FPS': 60, # UI frame pacing, None renders as fast as possible
+
     'WINDOW_SIZE': tuple(map(lambda x: int(x*1.75), (800, 600))),
     'FONT_SCALE': 3.5
 
@@ -40,9 +53,15 @@ class hssGUI():
     def __init__(self, cfg):
         self.state = 'init'
         self.cfg = cfg
+        self.logger = logging.Logger()
         self.set_tracker()
 
-        self.IR_texture = create_empty_texture(100, 100)
+        self.IR_texture = None # StreamingTexture of the shooting view, sized on first use
+
+        """ shooting view: static layers by (state, scale, puck, shooting line) """
+        self.layer_cache = {}
+        self.frame_buffer = None
+        self.draw_colors = {} # imgui packed colors of the vector view
 
         """ imgui stuff """
         pygame.init()
@@ -53,9 +72,16 @@ class hssGUI():
         io.display_size = cfg['WINDOW_SIZE']
 
         self.renderer = PygameRenderer()
+        self.frame_clock = pygame.time.Clock()
 
         """ disk output """
-        self.output_file = None
+        self.output_log = None
+
+        """ set by device_lost (cwiid thread), handled by main_loop """
+        self.device_failed = threading.Event()
+
+        """ serializes reports (cwiid thread) and configuration changes """
+        self.tracker_lock = threading.Lock()
 
 
         self.colors = {
@@ -79,10 +105,25 @@ class hssGUI():
         }
 
     def set_tracker(self):
+        ''' new tracker, at startup and when a session starts '''
         self.tracker = Tracker(self.cfg['PUCK_POSITION'],
             puck_proximity=self.cfg['SHOOT_SENSITIVITY'],
             stick_height=self.cfg['STICK_HEIGHT'],
-            camera_rotation=self.cfg['CAMERA_ROTATION'])
+            camera_rotation=self.cfg['CAMERA_ROTATION'],
+            publish_frames=True)
+
+    def apply_config(self):
+        ''' applies configuration changes to the current tracker in place '''
+        with self.tracker_lock:
+            self.tracker.reconfigure(puck_height=self.cfg['PUCK_POSITION'],
+                puck_proximity=self.cfg['SHOOT_SENSITIVITY'],
+                stick_height=self.cfg['STICK_HEIGHT'],
+                camera_rotation=self.cfg['CAMERA_ROTATION'])
+
+    def receive(self, mesg, time):
+        ''' wiimote callback (cwiid thread) '''
+        with self.tracker_lock:
+            self.tracker.receive(mesg[1], time)
 
     def get_color(self, color, to_np_array=False):
         rgb_color = self.colors[color][::-1]
@@ -91,69 +132,198 @@ class hssGUI():
         else:
             return rgb_color
 
-    def new_output_file(self):
+    def new_output_file(self, kind):
         present = datetime.now()
-        self.output_file = open(os.path.join('output', present.strftime("%y%m%d%H%M%s")) + '.test', 'w' )
+        self.output_log = open_session_log(os.path.join('output', present.strftime("%y%m%d%H%M%s")),
+            kind, fmt=self.cfg['SESSION_LOG_FORMAT'], trajectory=self.cfg['TRAJECTORY_FORMAT'],
+            background=True, max_bytes=self.cfg['SESSION_LOG_ROTATE_BYTES'],
+            compress=self.cfg['SESSION_LOG_COMPRESS'])
+
+        with self.tracker_lock:
+            self.tracker.set_logging_point(self.output_log)
 
 
+    def device_lost(self, mesg, time):
+        """
+        cwiid error callback, runs on cwiid's thread: only flags the error,
+        main_loop drops the device (closing it here would join this very
+        thread) and ends the play
+        """
+        self.device_failed.set()
+
+    def drop_device(self):
+        """ GUI thread side of device_lost, main screen then offers reconnecting """
+        global wiimote
+
+        self.logger.error("Error message received from Wiimote callback!! Disconnecting")
+        if wiimote is not None:
+            wiimote.close()
+            wiimote = None
+
+        if self.state in ('free_shoot', 'shoot_ten'):
+            self.end_play()
+
     def end_play(self):
         self.state = 'play_results'
 
-        if self.output_file is not None:
-            delta = datetime.now() - self.tracker.logger.logtimestamp
-            self.output_file.write("Ending play after %s\n" % (delta.total_seconds()))
-            self.output_file = None
+        if self.output_log is not None:
+            ''' detaching restarts the session clock, so elapsed is read first '''
+            with self.tracker_lock:
+                elapsed = self.tracker.session_time()
+                self.tracker.set_logging_point(None)
+
+            self.output_log.end(elapsed)
+            self.output_log.close()
+            self.output_log = None
 
     def clear(self):
         glClearColor(0.1, 0.1, 0.1, 0.0)
         glClear(GL_COLOR_BUFFER_BIT)
 
     """ SCREENS """
-    def shooting_subscreen(self, extra_resize=1.0):
-        ''' IR data background '''
-        img = np.zeros((cwiid.IR_Y_MAX, cwiid.IR_X_MAX, 3), np.uint8)
+    def static_layer(self, state, scale):
+        '''
+        Background, shooting line and puck of state at output scale,
+        rendered once per configuration
+        '''
+        key = (state, scale, self.tracker.puck_position, self.tracker.shooting_line)
+        layer = self.layer_cache.get(key)
+        if layer is not None:
+            return layer
+
+        if len(self.layer_cache) >= 3:
+            ''' configuration changed, drops layers of the previous one '''
+            self.layer_cache.clear()
+
+        size = (int(cwiid.IR_Y_MAX * scale), int(cwiid.IR_X_MAX * scale))
+        layer = np.empty(size + (3,), np.uint8)
 
         ''' different background if calibrated '''
-        img += self.get_color({
+        layer[:] = self.get_color({
             'U': 'background_not_ok',
             'W': 'background_waiting',
             'S': 'background_shooting'
-        }[self.tracker.state], to_np_array=True)
+        }[state], to_np_array=True)
 
-        ''' draw detected sources '''
-        for source in self.tracker.current_sources:
-            img = cv2.circle(img, source['pos'], 10, self.get_color('LED_normal'), -1)
+        ''' draws shooting line '''
+        if state in ('W', 'S'):
+            y = int(self.tracker.shooting_line * scale)
+            cv2.line(layer, (0, y), (size[1], y), self.get_color('shooting_line'), max(1, int(round(scale))))
 
-        ''' draws touching point '''
-        if self.tracker.touching_point is not None:
-            img = cv2.circle(img, self.tracker.touching_point, self.tracker.puck_proximity, self.get_color('LED_virtual'), -1)
+        ''' draw puck position '''
+        if state not in ('S'):
+            cv2.circle(layer, self.scaled(self.tracker.puck_position, scale), int(10 * scale), self.get_color('puck'), -1)
 
-        ''' draws shooting line '''
-        if self.tracker.state in ('W', 'S'):
-            img = cv2.line(img, (0, int(self.tracker.shooting_line)), (cwiid.IR_X_MAX, int(self.tracker.shooting_line)), self.get_color('shooting_line'))
+        self.layer_cache[key] = layer
+        return layer
 
-        ''' draws tracking result (debugging) '''
-        if self.tracker.current_snapshot is not None:
-            img = cv2.circle(img, self.tracker.current_snapshot[0]['pos'], 10, self.get_color('LED_1'), -1)
-            img = cv2.circle(img, self.tracker.current_snapshot[1]['pos'], 10, self.get_color('LED_2'), -1)
+    def scaled(self, point, scale):
+        return (int(point[0] * scale), int(point[1] * scale))
 
-        ''' draw puck position '''
-        if self.tracker.state not in ('S'):
-            img = cv2.circle(img, self.tracker.puck_position, 10, self.get_color('puck'), -1)
+    def draw_color(self, color):
+        ''' imgui packed color, colors are RGB '''
+        packed = self.draw_colors.get(color)
+        if packed is None:
+            r, g, b = self.colors[color]
+            packed = self.draw_colors[color] = imgui.get_color_u32_rgba(r / 255.0, g / 255.0, b / 255.0, 1.0)
+        return packed
 
-        ''' updates texture '''
-        img = cv2.resize(img, (0,0), fx=extra_resize*1.5, fy=extra_resize*1.5)
-        self.IR_texture = cv_image2texture(img, texture=self.IR_texture[0])
-        imgui.image(self.IR_texture[0], self.IR_texture[1], self.IR_texture[2])
+    def shooting_subscreen(self, extra_resize=1.0):
+        ''' renders the latest frame published by the tracker (device thread) '''
+        frame = self.tracker.frame
+        scale = extra_resize*0.75
+
+        if self.cfg['SHOOTING_VIEW_RENDER'] == 'vector':
+            self.vector_shooting_view(frame, scale)
+        else:
+            self.raster_shooting_view(frame, scale)
 
         ''' message / tip '''
-        if self.tracker.state in ('U'):
+        if frame.state in ('U'):
             imgui.text(self.messages['calibration_not_ok'])
-        elif self.tracker.state in ('W'):
+        elif frame.state in ('W'):
             imgui.text(self.messages['waiting_shoot'])
-        elif self.tracker.state in ('S'):
+        elif frame.state in ('S'):
             imgui.text(self.messages['shooting'])
 
+    def vector_shooting_view(self, frame, scale):
+        ''' IR data as imgui draw list primitives in screen coordinates '''
+        x0, y0 = imgui.get_cursor_screen_pos()
+        width, height = cwiid.IR_X_MAX * scale, cwiid.IR_Y_MAX * scale
+        draw_list = imgui.get_window_draw_list()
+
+        def to_screen(point):
+            return x0 + point[0] * scale, y0 + point[1] * scale
+
+        def circle(point, radius, color):
+            x, y = to_screen(point)
+            draw_list.add_circle_filled(x, y, radius * scale, self.draw_color(color))
+
+        state = frame.state
+
+        ''' different background if calibrated '''
+        draw_list.add_rect_filled(x0, y0, x0 + width, y0 + height, self.draw_color({
+            'U': 'background_not_ok',
+            'W': 'background_waiting',
+            'S': 'background_shooting'
+        }[state]))
+
+        ''' draws shooting line '''
+        if state in ('W', 'S'):
+            y = y0 + self.tracker.shooting_line * scale
+            draw_list.add_line(x0, y, x0 + width, y, self.draw_color('shooting_line'), max(1.0, scale))
+
+        ''' draw puck position '''
+        if state not in ('S'):
+            circle(self.tracker.puck_position, 10, 'puck')
+
+        ''' draw detected sources '''
+        for source in frame.sources:
+            circle(source.pos, 10, 'LED_normal')
+
+        ''' draws touching point '''
+        if frame.touching_point is not None:
+            circle(frame.touching_point, self.tracker.puck_proximity, 'LED_virtual')
+
+        ''' draws tracking result (debugging) '''
+        if frame.snapshot is not None:
+            circle(frame.snapshot[0], 10, 'LED_1')
+            circle(frame.snapshot[1], 10, 'LED_2')
+
+        ''' reserves the drawn area in the window layout '''
+        imgui.dummy(width, height)
+
+    def raster_shooting_view(self, frame, scale):
+        ''' IR data at output size: cached static layer + dynamic elements '''
+        layer = self.static_layer(frame.state, scale)
+
+        if self.frame_buffer is None or self.frame_buffer.shape != layer.shape:
+            self.frame_buffer = np.empty_like(layer)
+        img = self.frame_buffer
+        np.copyto(img, layer)
+
+        ''' draw detected sources '''
+        for source in frame.sources:
+            cv2.circle(img, self.scaled(source.pos, scale), int(10 * scale), self.get_color('LED_normal'), -1)
+
+        ''' draws touching point '''
+        if frame.touching_point is not None:
+            cv2.circle(img, self.scaled(frame.touching_point, scale),
+                int(self.tracker.puck_proximity * scale), self.get_color('LED_virtual'), -1)
+
+        ''' draws tracking result (debugging) '''
+        if frame.snapshot is not None:
+            cv2.circle(img, self.scaled(frame.snapshot[0], scale), int(10 * scale), self.get_color('LED_1'), -1)
+            cv2.circle(img, self.scaled(frame.snapshot[1], scale), int(10 * scale), self.get_color('LED_2'), -1)
+
+        ''' updates texture '''
+        if self.IR_texture is None or not self.IR_texture.fits(img):
+            if self.IR_texture is not None:
+                self.IR_texture.delete()
+            self.IR_texture = StreamingTexture(img.shape[1], img.shape[0], pbo=self.cfg['TEXTURE_PBO'])
+        self.IR_texture.update(img)
+        imgui.image(self.IR_texture.id, self.IR_texture.width, self.IR_texture.height)
+
     def end_play_subscreen(self):
         ''' Button / action for interrupting a play '''
         if imgui.button("Stop",
@@ -161,7 +331,7 @@ class hssGUI():
             self.end_play()
 
     def play_results_screen(self):
-        imgui.text("You performed %d shots!" % (self.tracker.shoot_counter))
+        imgui.text("You performed %d shots!" % (self.tracker.frame.shoot_counter))
 
         if imgui.button("Back to main",
             width=self.cfg['WINDOW_SIZE'][0], height=self.cfg['WINDOW_SIZE'][1]/4):
@@ -173,9 +343,6 @@ class hssGUI():
         self.state = 'connecting'
 
     def main_screen(self):
-        #self.tracker.reset_shoot_counter()
-        self.set_tracker()
-
         global wiimote
 
         if wiimote is None:
@@ -189,17 +356,15 @@ class hssGUI():
                 width=self.cfg['WINDOW_SIZE'][0], height=self.cfg['WINDOW_SIZE'][1]/5):
                 self.state = 'free_shoot'
 
-                self.new_output_file()
-                self.tracker.set_logging_point(self.output_file)
-                self.output_file.write("Starting free shoot \n")
+                self.set_tracker()
+                self.new_output_file(FREE_SHOOT)
 
             if imgui.button("Shoot 10",
                 width=self.cfg['WINDOW_SIZE'][0], height=self.cfg['WINDOW_SIZE'][1]/5):
                 self.state = 'shoot_ten'
 
-                self.new_output_file()
-                self.tracker.set_logging_point(self.output_file)
-                self.output_file.write("Starting shoot 10 \n")
+                self.set_tracker()
+                self.new_output_file(SHOOT_TEN)
 
         if imgui.button("Configuration",
             width=self.cfg['WINDOW_SIZE'][0], height=self.cfg['WINDOW_SIZE'][1]/6):
@@ -216,18 +381,21 @@ class hssGUI():
 
         self.shooting_subscreen()
 
-        imgui.text("Shoots: %d" % (self.tracker.shoot_counter))
+        imgui.text("Shoots: %d" % (self.tracker.frame.shoot_counter))
 
         self.end_play_subscreen()
 
     def shoot_10_screen(self):
+        ''' one published frame for the count shown and the end check '''
+        frame = self.tracker.frame
+
         self.shooting_subscreen()
 
-        imgui.text("Shoots: %d/%d" % (self.tracker.shoot_counter, 10))
+        imgui.text("Shoots: %d/%d" % (frame.shoot_counter, 10))
 
         self.end_play_subscreen()
 
-        if self.tracker.shoot_counter >= 10:
+        if frame.shoot_counter >= 10:
             self.end_play()
 
     def edit_screen(self):
@@ -240,12 +408,12 @@ class hssGUI():
             c, _ = imgui.menu_item('0')
             if c:
                 self.cfg['CAMERA_ROTATION'] = 0
-                self.set_tracker()
+                self.apply_config()
 
             c, _ = imgui.menu_item('180')
             if c:
                 self.cfg['CAMERA_ROTATION'] = 180
-                self.set_tracker()
+                self.apply_config()
 
             imgui.end_menu()
 
@@ -253,19 +421,19 @@ class hssGUI():
             self.cfg['SHOOT_SENSITIVITY'], 5.0, 250.0, '%.1f')
         if c:
             self.cfg['SHOOT_SENSITIVITY'] = v
-            self.set_tracker()
+            self.apply_config()
 
         c, v = imgui.slider_float('Stick head length',
             self.cfg['STICK_HEIGHT'], 10.0, 300.0, '%.1f')
         if c:
             self.cfg['STICK_HEIGHT'] = v
-            self.set_tracker()
+            self.apply_config()
 
         c, v = imgui.slider_float('Puck height',
             self.cfg['PUCK_POSITION']/float(cwiid.IR_Y_MAX), 0.6, 1.0, '%.2f')
         if c:
             self.cfg['PUCK_POSITION'] = v * cwiid.IR_Y_MAX
-            self.set_tracker()
+            self.apply_config()
 
         if wiimote is not None:
             self.shooting_subscreen(extra_resize=0.75)
@@ -283,11 +451,13 @@ class hssGUI():
             width=self.cfg['WINDOW_SIZE'][0], height=self.cfg['WINDOW_SIZE'][1]/10):
             if self.stashed_config is not None:
                 self.cfg = copy.deepcopy(self.stashed_config)
+                self.apply_config()
 
         if imgui.button("Discard changes",
             width=self.cfg['WINDOW_SIZE'][0], height=self.cfg['WINDOW_SIZE'][1]/10):
             if self.stashed_config is not None:
                 self.cfg = copy.deepcopy(self.stashed_config)
+                self.apply_config()
 
             self.state = 'main'
 
@@ -340,11 +510,20 @@ class hssGUI():
         imgui.render()
         pygame.display.flip()
 
+        ''' frame pacing, tracking runs at device rate on the callback thread '''
+        if self.cfg['MAX_FPS']:
+            self.frame_clock.tick(self.cfg['MAX_FPS'])
+
+        ''' handles device errors reported by the cwiid thread '''
+        if self.device_failed.is_set():
+            self.device_failed.clear()
+            self.drop_device()
+
         ''' handles wiimote connection after rendering instructions '''
         if self.state == 'connecting':
             while wiimote is None:
                 wiimote = get_wiimote() # hangs interface
-            wiimote.mesg_callback = high_callback(lambda mesg, time: self.tracker.receive(mesg[1], time))
+            wiimote.mesg_callback = high_callback(self.receive, on_error=self.device_lost)
 
             self.state = 'main'
 
@@ -355,7 +534,7 @@ def main():
         try:
             gui.main_loop()
         except KeyError as e:
-            print(e)
+            gui.logger.error("Interface error: %s", e)
 
 
 if __name__ == '__main__':
@@ -1,38 +1,74 @@
-import pygame
+import ctypes
+
 import numpy as np
-import cv2
 import OpenGL.GL as gl
 from OpenGL.GL import *
 
 
-def cv_image2texture(cv_image_bgr, texture = None):
-    image_rgb = cv2.cvtColor(cv_image_bgr, cv2.COLOR_BGR2RGB)
-    image_rgb = cv2.resize(image_rgb, None, fx=0.5, fy=0.5)
-    image_rgb = cv2.flip(image_rgb, -1)
-    pygame_img = pygame.image.frombuffer(image_rgb.tostring(), image_rgb.shape[1::-1], "RGB")
-    pygame_img = pygame.transform.flip(pygame_img, True, True)
+class StreamingTexture():
+    """
+    Texture whose GL storage is allocated once and updated in place
+
+    update() uploads a BGR uint8 NumPy image straight from its buffer:
+    GL_BGR takes OpenCV's channel order and rows go top first, as
+    imgui.image shows them, so no per-frame conversion or copy is needed
+    pbo: uploads through two pixel buffer objects, the driver copies one
+        to the texture while the next frame is written into the other
+    """
+    def __init__(self, width, height, pbo=False):
+        self.width = width
+        self.height = height
+
+        self.id = gl.glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.id)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB8, width, height, 0, GL_BGR, GL_UNSIGNED_BYTE, None)
+
+        self.nbytes = width * height * 3
+        self.pbos = None
+        self.next_pbo = 0
 
-    textureSurface = pygame.transform.flip(pygame_img, False, True)
+        if pbo:
+            self.pbos = gl.glGenBuffers(2)
+            for buffer in self.pbos:
+                glBindBuffer(GL_PIXEL_UNPACK_BUFFER, buffer)
+                glBufferData(GL_PIXEL_UNPACK_BUFFER, self.nbytes, None, GL_STREAM_DRAW)
+            glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
 
-    textureData = pygame.image.tostring(textureSurface, "RGBA", 1)
+    def fits(self, image):
+        return image.shape[:2] == (self.height, self.width)
 
-    width = textureSurface.get_width()
-    height = textureSurface.get_height()
+    def update(self, image_bgr):
+        """ image_bgr: (height, width, 3) uint8 array """
+        image_bgr = np.ascontiguousarray(image_bgr, dtype=np.uint8)
 
-    if texture is None:
-        texture = gl.glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.id)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
 
-    glBindTexture(GL_TEXTURE_2D, texture)
+        if self.pbos is None:
+            glTexSubImage2D(GL_TEXTURE_2D, 0, 0, 0, self.width, self.height,
+                GL_BGR, GL_UNSIGNED_BYTE, image_bgr)
+            return
 
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, textureData)
+        buffer = self.pbos[self.next_pbo]
+        self.next_pbo = 1 - self.next_pbo
 
-    return texture, width, height
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, buffer)
+        ''' orphans the previous storage, so mapping never waits for the GPU '''
+        glBufferData(GL_PIXEL_UNPACK_BUFFER, self.nbytes, None, GL_STREAM_DRAW)
+        target = glMapBuffer(GL_PIXEL_UNPACK_BUFFER, GL_WRITE_ONLY)
+        if target:
+            ctypes.memmove(target, image_bgr.ctypes.data, self.nbytes)
+        glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER)
 
+        glTexSubImage2D(GL_TEXTURE_2D, 0, 0, 0, self.width, self.height,
+            GL_BGR, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
 
-def create_empty_texture(width, height):
-    size = height, width, 3
-    m = np.zeros(size, dtype=np.uint8)
+    def delete(self):
+        if self.pbos is not None:
+            gl.glDeleteBuffers(2, self.pbos)
+            self.pbos = None
+        gl.glDeleteTextures([self.id])
 
-    return cv_image2texture(m)
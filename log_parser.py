@@ -1,42 +1,148 @@
 import sys
 import os
 import re
+import gzip
+import argparse
+import collections
+import multiprocessing
+import time as clock
 
-def file_stats(file_ptr):
+import session_log
+from log_writer import segment_path, segment_paths
+from stats_cache import StatsCache, DEFAULT_MAX_SESSIONS
+from shot_stats import ShotTable
+
+CHUNK_SIZE = 1 << 16
+
+''' one pattern classifies every line, frame lines simply do not match '''
+EVENT_LINE = re.compile(
+    r'^(?:(?P<event>Shoot started|Shoot ended|Calibrating|Lost track)[^\[\n]*\[(?P<time>[^\]\n]*)\]'
+    r'|Ending play after\s*(?P<total>\S+))',
+    re.MULTILINE)
+
+EVENT_TYPES = {
+    'Shoot started': session_log.SHOT_START,
+    'Shoot ended': session_log.SHOT_END,
+    'Calibrating': session_log.CALIBRATION,
+    'Lost track': session_log.LOST_TRACK,
+}
+
+def tokenize(file_ptr, chunk_size=CHUNK_SIZE):
+    '''
+    Streams (event type, time) pairs of a .test log (see session_log types)
+    Reads fixed-size chunks, memory use does not depend on the file size
+    '''
+    tail = ''
+
+    while True:
+        chunk = file_ptr.read(chunk_size)
+
+        if chunk:
+            chunk = tail + chunk
+            cut = chunk.rfind('\n') + 1
+            chunk, tail = chunk[:cut], chunk[cut:]
+        else:
+            chunk, tail = tail, ''
+
+        for event in chunk_events(chunk):
+            yield event
+
+        if not chunk and not tail:
+            return
+
+def chunk_events(chunk):
+    ''' (event type, time) pairs of the complete lines of chunk '''
+    for match in EVENT_LINE.finditer(chunk):
+        event = match.group('event')
+        if event is not None:
+            yield EVENT_TYPES[event], float(match.group('time'))
+        else:
+            yield session_log.SESSION_END, float(match.group('total'))
+
+def follow(path, poll_interval=0.5, stop=None):
+    '''
+    Streams (event type, time) pairs of a .test log while it is written,
+    like tail -f: only new bytes are read and parsed
+    Follows rotated segments (see log_writer), not gzipped logs
+    Ends after the play end line, or when stop() is true
+    '''
+    segment = 0
+    file_ptr = open(path)
+    tail = ''
+
+    try:
+        while True:
+            chunk = file_ptr.read(CHUNK_SIZE)
+
+            if chunk:
+                chunk = tail + chunk
+                cut = chunk.rfind('\n') + 1
+                chunk, tail = chunk[:cut], chunk[cut:]
+
+                for event in chunk_events(chunk):
+                    yield event
+                    if event[0] == session_log.SESSION_END:
+                        return
+                continue
+
+            next_segment = segment_path(path, segment + 1)
+            if os.path.exists(next_segment):
+                ''' rotated, the rest of the current segment is complete '''
+                for event in chunk_events(tail + file_ptr.read()):
+                    yield event
+                    if event[0] == session_log.SESSION_END:
+                        return
+                file_ptr.close()
+                file_ptr = open(next_segment)
+                segment, tail = segment + 1, ''
+                continue
+
+            if stop is not None and stop():
+                return
+            clock.sleep(poll_interval)
+    finally:
+        file_ptr.close()
+
+def log_events(path):
+    '''
+    (event type, time) pairs of a .test or binary .hsl session log
+    .test logs may be rotated and gzipped (see log_writer)
+    '''
+    if path.endswith('.hsl'):
+        for event in session_log.iter_events(path):
+            yield event
+        return
+
+    for segment in segment_paths(path[:-len('.gz')] if path.endswith('.gz') else path):
+        with (gzip.open(segment, 'rt') if segment.endswith('.gz') else open(segment)) as file_ptr:
+            for event in tokenize(file_ptr):
+                yield event
+
+def stats_from_events(events):
     counter = {
         k: [] for k in (
             'shoots', 'calibrations', 'loses'
         )
     }
-    #print(counter)
-
-    for line in file_ptr.readlines():
-        if line.endswith(']\n'):
-            timestamp = float(line[(len(line) - line[::-1].find('[')):-2])
-
-            #print(line)
-            #print(timestamp)
 
-
-        ''' '''
-        if 'Shoot started' in line:
+    for (event, timestamp) in events:
+        if event == session_log.SHOT_START:
             counter['shoots'].append({
                 'start': timestamp
             })
 
-        elif 'Shoot ended' in line:
-            counter['shoots'][-1].update({
-                'end': timestamp
-            })
+        elif event == session_log.SHOT_END:
+            ''' ignores ends without a pending start '''
+            if counter['shoots'] and 'end' not in counter['shoots'][-1]:
+                counter['shoots'][-1]['end'] = timestamp
 
-        elif 'Calibrating' in line:
+        elif event == session_log.CALIBRATION:
             counter['calibrations'].append(timestamp)
 
-        elif 'Lost track' in line:
+        elif event == session_log.LOST_TRACK:
             counter['loses'].append(timestamp)
 
-        elif 'Ending play after' in line:
-            timestamp = float(line[line.find('r')+1:])
+        elif event == session_log.SESSION_END:
             counter['total_time'] = timestamp
 
     ''' removes shoots without end '''
@@ -44,6 +150,60 @@ def file_stats(file_ptr):
 
     return counter
 
+class LiveStats():
+    '''
+    Running meta_stats of a session being recorded, each update costs
+    the same whatever the session length
+    '''
+    def __init__(self):
+        self.shoots = 0
+        self.calibrations = 0
+        self.loses = 0
+        self.total_time = None
+
+        self.pending_start = None
+        self.last_shoot_time = None
+        self.counted_shoots = 0 # first 10, as meta_stats
+        self.counted_time = 0.0
+
+    def update(self, event, timestamp):
+        if event == session_log.SHOT_START:
+            self.pending_start = timestamp
+
+        elif event == session_log.SHOT_END:
+            ''' ignores ends without a pending start '''
+            if self.pending_start is not None:
+                self.last_shoot_time = timestamp - self.pending_start
+                self.shoots += 1
+                if self.counted_shoots < 10:
+                    self.counted_shoots += 1
+                    self.counted_time += self.last_shoot_time
+                self.pending_start = None
+
+        elif event == session_log.CALIBRATION:
+            self.calibrations += 1
+
+        elif event == session_log.LOST_TRACK:
+            self.loses += 1
+
+        elif event == session_log.SESSION_END:
+            self.total_time = timestamp
+
+    def meta(self):
+        ''' as meta_stats, total_time is None while the play goes on '''
+        return {
+            'calibrations': self.calibrations,
+            'loses': self.loses,
+            'shoot_mean_time': self.counted_time / self.counted_shoots if self.counted_shoots else None,
+            'total_time': self.total_time,
+        }
+
+def file_stats(file_ptr):
+    return stats_from_events(tokenize(file_ptr))
+
+def path_stats(path):
+    return stats_from_events(log_events(path))
+
 def meta_stats(stats):
     meta = {
         'calibrations': len(stats['calibrations']),
@@ -58,26 +218,220 @@ def meta_stats(stats):
             'total': shoot['end'] - shoot['start']
         })
 
+    ''' None without completed shoots '''
     meta.update({
-        'shoot_mean_time': sum(map(lambda x: x['total'], shoots)) / len(shoots),
+        'shoot_mean_time': sum(map(lambda x: x['total'], shoots)) / len(shoots) if shoots else None,
         'total_time': stats['total_time']
     })
 
     return meta
 
+def analyze_file(path):
+    '''
+    worker side: (path, stats, meta), meta is None for incomplete sessions
+    an unreadable log gives (path, None, error message) instead of raising,
+    so one bad file never aborts a directory report
+    '''
+    try:
+        stats = path_stats(path)
+    except Exception as e:
+        return path, None, "%s: %s" % (type(e).__name__, e)
+
+    try:
+        meta = meta_stats(stats)
+    except KeyError:
+        meta = None
+
+    return path, stats, meta
+
+def log_files(directory):
+    return sorted(
+        os.path.join(directory, f) for f in os.listdir(directory)
+        if f.endswith('.test') or f.endswith('.test.gz') or f.endswith('.hsl')
+    )
+
+def analyze_directory(directory, workers=None, max_in_flight=None, progress=None, cache=None, failed=None):
+    '''
+    Analyzes every session log of directory in a process pool
+    Results are returned in path order, see analyze_paths
+    '''
+    return analyze_paths(log_files(directory), workers, max_in_flight, progress, cache, failed)
+
+def analyze_paths(paths, workers=None, max_in_flight=None, progress=None, cache=None, failed=None):
+    '''
+    Analyzes session logs in a process pool
+
+    At most max_in_flight files are queued at once (default: 4 per worker)
+    Results are returned in paths order whatever the completion order
+    progress(done, total, elapsed) is called after each parsed file
+    cache: optional stats_cache.StatsCache, only logs missing from it
+        (or changed since) are parsed
+    failed: optional list, gets the (path, error message) of every log
+        that could not be read; those logs are left out of the results
+    '''
+    workers = workers or multiprocessing.cpu_count()
+    max_in_flight = max_in_flight or 4 * workers
+
+    results = {}
+    if cache is not None:
+        for path in paths:
+            cached = cache.get(path)
+            if cached is not None:
+                results[path] = (path,) + tuple(cached)
+
+    missing = [path for path in paths if path not in results]
+    done = []
+    pending = collections.deque()
+    start = clock.time()
+
+    def collect():
+        result = pending.popleft().get()
+        done.append(result[0])
+
+        if result[1] is None:
+            if failed is not None:
+                failed.append((result[0], result[2]))
+        else:
+            results[result[0]] = result
+            if cache is not None:
+                cache.put(*result)
+        if progress is not None:
+            progress(len(done), len(missing), clock.time() - start)
+
+    if missing:
+        pool = multiprocessing.Pool(workers)
+        try:
+            for path in missing:
+                if len(pending) >= max_in_flight:
+                    collect()
+
+                pending.append(pool.apply_async(analyze_file, (path,)))
+
+            while pending:
+                collect()
+        finally:
+            pool.close()
+            pool.join()
+
+    if cache is not None:
+        cache.save()
+
+    return [results[path] for path in paths if path in results]
+
+def print_progress(done, total, elapsed):
+    sys.stderr.write("\r%d/%d files (%.1f files/s)" % (done, total, done / max(elapsed, 1e-9)))
+    if done == total:
+        sys.stderr.write("\n")
+
+def print_summary(table):
+    ''' cross-session report, see shot_stats '''
+    summary = table.summary()
+
+    print("%d sessions, %d shoots, mean shoot time %.3f" % (
+        summary['sessions'], summary['shots'], summary['shot_mean_time']))
+    print("shoot time percentiles " + ' '.join(
+        "p%d=%.3f" % (p, t) for (p, t) in sorted(summary['shot_percentiles'].items())))
+    print("%.2f calibrations/min, %.2f lost tracks/min, first shoot after %.2f" % (
+        summary['calibration_rate'], summary['lose_rate'], summary['time_to_first_shot']))
+
+    counts, edges = table.duration_histogram()
+    for (count, low, high) in zip(counts, edges[:-1], edges[1:]):
+        print("  %7.3f-%7.3f %6d" % (low, high, count))
+
+    days = table.per_day()
+    for i in range(len(days['day'])):
+        print("%s %4d sessions %5d shoots  mean %.3f  first %.2f  %.2f cal/min  %.2f lost/min" % (
+            days['day'][i], days['sessions'][i], days['shots'][i], days['shot_mean_time'][i],
+            days['time_to_first_shot'][i], days['calibration_rate'][i], days['lose_rate'][i]))
+
+def latest_log(directory):
+    ''' most recently modified .test log of directory '''
+    logs = [path for path in log_files(directory) if path.endswith('.test')]
+    if not logs:
+        return None
+    return max(logs, key=os.path.getmtime)
+
+def follow_log(path, poll_interval):
+    ''' prints running stats of a session log being recorded '''
+    print("following %s" % path)
+    live = LiveStats()
+
+    for (event, timestamp) in follow(path, poll_interval):
+        live.update(event, timestamp)
+
+        if event == session_log.SHOT_END and live.last_shoot_time is not None:
+            print("[%.2f] shoot %d: %.3f s" % (timestamp, live.shoots, live.last_shoot_time))
+        elif event == session_log.LOST_TRACK:
+            print("[%.2f] lost track (%d)" % (timestamp, live.loses))
+
+        if event in (session_log.SHOT_END, session_log.SESSION_END):
+            print(live.meta())
+
 def main():
-    prometido = os.path.join("test_output", "18120218221543782131.test")
-    _ = file_stats(open(prometido))
-    #print(_)
+    parser = argparse.ArgumentParser(description="Shot statistics of session logs")
+    parser.add_argument('directory', nargs='?', default="test_output")
+    parser.add_argument('--workers', type=int, default=None,
+        help="worker processes (default: one per CPU)")
+    parser.add_argument('--in-flight', type=int, default=None,
+        help="maximum files queued at once (default: 4 per worker)")
+    parser.add_argument('--all', action='store_true',
+        help="report every session, not only the ones with 10-11 shots")
+    parser.add_argument('--quiet', action='store_true', help="no progress report")
+    parser.add_argument('--cache', default=None,
+        help="stats cache file (default: <directory>/.stats_cache.json)")
+    parser.add_argument('--cache-sessions', type=int, default=DEFAULT_MAX_SESSIONS,
+        help="maximum number of sessions kept in the cache, least recently used are evicted")
+    parser.add_argument('--no-cache', action='store_true', help="parse every log")
+    parser.add_argument('--rebuild-cache', action='store_true',
+        help="discard the cache and parse every log again")
+    parser.add_argument('--summary', action='store_true',
+        help="cross-session distributions and per-day rollups instead of per-session stats")
+    parser.add_argument('--follow', action='store_true',
+        help="running stats of the session being recorded (the newest .test log of "
+            "directory, or directory itself if it is a log)")
+    parser.add_argument('--poll', type=float, default=0.5,
+        help="seconds between checks for new lines when following")
+    args = parser.parse_args()
+
+    if args.follow:
+        path = args.directory if os.path.isfile(args.directory) else latest_log(args.directory)
+        if path is None:
+            parser.error("no .test log to follow in %s" % args.directory)
+
+        try:
+            follow_log(path, args.poll)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    cache = None
+    if not args.no_cache:
+        cache = StatsCache(args.cache or os.path.join(args.directory, '.stats_cache.json'),
+            max_sessions=args.cache_sessions)
+        if args.rebuild_cache:
+            cache.clear()
+
+    failed = []
+    results = analyze_directory(args.directory,
+        workers=args.workers, max_in_flight=args.in_flight,
+        progress=None if args.quiet else print_progress,
+        cache=cache, failed=failed)
+
+    for (log_file, error) in failed:
+        sys.stderr.write("skipped %s (%s)\n" % (log_file, error))
+
+    if cache is not None and not args.quiet:
+        sys.stderr.write("cache: %d hits, %d parsed\n" % (cache.hits, cache.misses))
 
-    for log_file in os.listdir("test_output"):
-        log_file = os.path.join("test_output", log_file)
-        stats = file_stats(open(log_file))
+    if args.summary:
+        print_summary(ShotTable(results))
+        return
 
+    for (log_file, stats, meta) in results:
         performed_shoots = len(stats['shoots'])
-        if (performed_shoots in range(10, 12)):
+        if args.all or (performed_shoots in range(10, 12)):
             print(performed_shoots, log_file)
 
-            print(meta_stats(stats))
+            print(meta)
 
 main() if __name__ == '__main__' else True
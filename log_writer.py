@@ -0,0 +1,209 @@
+""" Background log writer
+
+BackgroundWriter is a write-only file object whose writes are handed
+to a writer thread through a bounded queue, so a slow disk never stalls
+the caller (e.g. Tracker.receive logging a frame)
+
+The writer thread drains the queue into batches of up to batch_bytes
+and writes each batch at once. A write never blocks: once queue_size
+writes are pending, further ones are dropped and counted (reported on
+close), except "always" writes (events, the end of a session), which
+are queued regardless; they are rare, so the queue stays small
+
+A write can also ask the writer to note the offset it lands at
+(see offsets), so a caller can refer to it whatever was dropped before
+
+If the disk fails the writer keeps draining the queue without writing,
+so neither writes nor flush / close ever hang on it
+
+Options:
+    max_bytes: size-based rotation (uncompressed bytes), the log continues
+        in path.1, path.2...
+        (rotation happens between writes, a write is never split)
+    compress: gzip every segment as it is written (path.gz, path.1.gz...)
+"""
+import os
+import gzip
+import threading
+
+import logger as logging
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+QUEUE_SIZE = 8192
+BATCH_BYTES = 1 << 16
+
+logger = logging.Logger()
+
+
+def segment_path(path, segment, compress=False):
+    name = path if segment == 0 else "%s.%d" % (path, segment)
+    return name + '.gz' if compress else name
+
+
+def segment_paths(path):
+    """ existing segments of a (possibly rotated, possibly compressed) log, in order """
+    compress = not os.path.exists(path) and os.path.exists(path + '.gz')
+    segments = []
+
+    while os.path.exists(segment_path(path, len(segments), compress)):
+        segments.append(segment_path(path, len(segments), compress))
+
+    return segments
+
+
+def segments_signature(path):
+    """
+    (total size, latest modification time) over every segment of a log,
+    path may name the first segment of a compressed log (path.gz)
+    Rotation keeps the first segment unchanged, so its own size and mtime
+    would not tell a growing log apart
+    """
+    segments = segment_paths(path[:-len('.gz')] if path.endswith('.gz') else path) or [path]
+    stats = [os.stat(segment) for segment in segments]
+
+    return sum(st.st_size for st in stats), max(st.st_mtime for st in stats)
+
+
+class BackgroundWriter():
+    def __init__(self, path, max_bytes=None, compress=False,
+            queue_size=QUEUE_SIZE, batch_bytes=BATCH_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.queue_size = queue_size
+        self.batch_bytes = batch_bytes
+
+        self.segment = 0
+        self.segment_bytes = 0
+        self.file = self._open()
+
+        """ writer thread side """
+        self.written = 0 # bytes handed to the file, all segments
+        self.offsets = [] # where the writes asking for it landed, in order
+        self.error = None
+
+        self.pending = queue.Queue()
+        self.dropped = 0
+        self.closed = False
+
+        self.worker = threading.Thread(target=self._work, name="log-writer")
+        self.worker.daemon = True
+        self.worker.start()
+
+    """ Interface """
+    def write(self, data, always=False, offset=False):
+        """
+        Never blocks
+        always: queued even when the writer is behind, never dropped
+        offset: the writer appends the offset data lands at to offsets
+        """
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+
+        if not always and self.pending.qsize() >= self.queue_size:
+            self.dropped += 1
+            return
+
+        self.pending.put((data,) if offset else data)
+
+    def flush(self):
+        """ blocks until everything written so far is on disk (or failed) """
+        if not self.worker.is_alive():
+            return
+
+        done = threading.Event()
+        self.pending.put(done)
+        done.wait()
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.closed = True
+        self.pending.put(None)
+        self.worker.join()
+
+        if self.dropped:
+            logger.warning("Log writer fell behind, %d writes to %s were dropped", self.dropped, self.path)
+        if self.error is not None:
+            logger.error("Log writer failed on %s: %s", self.path, self.error)
+
+    """ Internal Methods """
+    def _open(self):
+        path = segment_path(self.path, self.segment, self.compress)
+        return gzip.open(path, 'wb') if self.compress else open(path, 'wb')
+
+    def _rotate(self):
+        self.file.close()
+        self.segment += 1
+        self.segment_bytes = 0
+        self.file = self._open()
+
+    def _write(self, batch):
+        if self.max_bytes is not None \
+                and self.segment_bytes + sum(map(len, batch)) > self.max_bytes:
+            """ keeps whole writes in a segment """
+            for data in batch:
+                if self.segment_bytes and self.segment_bytes + len(data) > self.max_bytes:
+                    self._rotate()
+                self.file.write(data)
+                self.segment_bytes += len(data)
+                self.written += len(data)
+            return
+
+        data = b''.join(batch)
+        self.file.write(data)
+        self.segment_bytes += len(data)
+        self.written += len(data)
+
+    def _work(self):
+        running = True
+
+        while running:
+            batch, size, markers = [], 0, []
+
+            """ blocks for the first item, then drains without waiting """
+            item = self.pending.get()
+            while True:
+                if item is None:
+                    running = False
+                    break
+                elif isinstance(item, tuple):
+                    self.offsets.append(self.written + size)
+                    item = item[0]
+
+                if isinstance(item, bytes):
+                    batch.append(item)
+                    size += len(item)
+                else:
+                    markers.append(item)
+                    break
+
+                if size >= self.batch_bytes:
+                    break
+
+                try:
+                    item = self.pending.get_nowait()
+                except queue.Empty:
+                    break
+
+            if self.error is None:
+                try:
+                    if batch:
+                        self._write(batch)
+                    if markers or not running:
+                        self.file.flush()
+                except (IOError, OSError) as e:
+                    self.error = e
+
+            for marker in markers:
+                marker.set()
+
+        try:
+            self.file.close()
+        except (IOError, OSError) as e:
+            self.error = self.error or e
@@ -0,0 +1,70 @@
+import sys
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+
+class Logger():
+    """
+    Leveled stdout logger
+
+    Messages are formatted lazily: logger.debug("%s", x) only builds
+    the string when the DEBUG level is enabled
+    Disabled levels are rebound to no-ops by set_level, so the "off"
+    path costs a single method call
+
+    Session data (shots, calibrations, frames) goes to session logs,
+    see session_log
+    """
+    COLORS = {
+        DEBUG: '\033[94m', # blue
+        INFO: '\033[92m', # green
+        WARNING: '\033[93m', # yellow
+        ERROR: '\033[91m', # red
+    }
+    ENDC = '\033[0m'
+
+    def __init__(self, level=INFO, colors=True, stream=None):
+        self.colors = colors
+        self.stream = stream if stream is not None else sys.stdout
+
+        self.set_level(level)
+
+    def set_level(self, level):
+        self.level = level
+
+        self.debug = self._debug if level <= DEBUG else self._skip
+        self.info = self._info if level <= INFO else self._skip
+        self.warning = self._warning if level <= WARNING else self._skip
+        self.error = self._error if level <= ERROR else self._skip
+
+    def is_enabled(self, level):
+        return self.level <= level
+
+    """ Levels """
+    def _skip(self, message, *args):
+        pass
+
+    def _debug(self, message, *args):
+        self._write(DEBUG, self._format(message, args))
+
+    def _info(self, message, *args):
+        self._write(INFO, self._format(message, args))
+
+    def _warning(self, message, *args):
+        self._write(WARNING, self._format(message, args))
+
+    def _error(self, message, *args):
+        self._write(ERROR, self._format(message, args))
+
+    """ Internal Methods """
+    def _format(self, message, args):
+        return message % args if args else str(message)
+
+    def _write(self, level, message):
+        if self.colors:
+            message = self.COLORS[level] + message + self.ENDC
+        self.stream.write(message + '\n')
@@ -0,0 +1,129 @@
+""" Source matching engines for Tracker._track_sources
+
+A matcher receives the positions of the tracked points and of the detected
+sources of a frame, builds a single squared distance matrix and solves the
+assignment for all tracked points at once.
+
+match() returns (assignment, cost) where
+    - assignment[k] is the source index matched to the k-th tracked point
+      (None if it could not be matched)
+    - cost is the sum of squared distances of the matched pairs
+"""
+
+
+def distance_matrix(tracked, sources):
+    """
+    Squared distances between every (tracked, source) pair
+    rows are tracked points, columns are sources
+    """
+    return [
+        [(s[0]-t[0])**2 + (s[1]-t[1])**2 for s in sources]
+        for t in tracked
+    ]
+
+
+class GreedyMatcher():
+    """
+    Greedy on sorted pairs: walks every (tracked, source) pair once,
+    from the closest to the farthest, taking a pair whenever
+    both of its ends are still free
+
+    Never stalls on sources equidistant to several tracked points,
+    the closest pair simply wins
+    """
+    def match(self, tracked, sources):
+        distances = distance_matrix(tracked, sources)
+
+        pairs = sorted(
+            (d, k, i)
+            for (k, row) in enumerate(distances)
+            for (i, d) in enumerate(row)
+        )
+
+        assignment = [None] * len(tracked)
+        used = set()
+        cost = 0
+
+        for (d, k, i) in pairs:
+            if assignment[k] is None and i not in used:
+                assignment[k] = i
+                used.add(i)
+                cost += d
+
+                if len(used) == len(tracked):
+                    break
+
+        return assignment, cost
+
+
+class HungarianMatcher():
+    """
+    Optimal assignment (Kuhn-Munkres) minimizing the total squared distance
+
+    O(n^2 m) for n tracked points and m >= n sources,
+    only worth it over GreedyMatcher when several tracked points
+    (e.g. stick plus gloves) get close to each other
+    """
+    def match(self, tracked, sources):
+        distances = distance_matrix(tracked, sources)
+
+        n, m = len(tracked), len(sources)
+        assignment = [None] * n
+
+        if n == 0 or m < n:
+            return assignment, 0
+
+        inf = float('inf')
+
+        """ potentials and matching use 1-based indexes, 0 is the free slot """
+        u = [0] * (n + 1)
+        v = [0] * (m + 1)
+        p = [0] * (m + 1) # p[j]: row matched to column j
+        way = [0] * (m + 1)
+
+        for i in range(1, n + 1):
+            p[0] = i
+            j0 = 0
+            minv = [inf] * (m + 1)
+            used = [False] * (m + 1)
+
+            while True:
+                used[j0] = True
+                i0 = p[j0]
+                delta = inf
+                j1 = 0
+
+                for j in range(1, m + 1):
+                    if not used[j]:
+                        cur = distances[i0-1][j-1] - u[i0] - v[j]
+                        if cur < minv[j]:
+                            minv[j] = cur
+                            way[j] = j0
+                        if minv[j] < delta:
+                            delta = minv[j]
+                            j1 = j
+
+                for j in range(m + 1):
+                    if used[j]:
+                        u[p[j]] += delta
+                        v[j] -= delta
+                    else:
+                        minv[j] -= delta
+
+                j0 = j1
+                if p[j0] == 0:
+                    break
+
+            """ augmenting path """
+            while j0:
+                j1 = way[j0]
+                p[j0] = p[j1]
+                j0 = j1
+
+        cost = 0
+        for j in range(1, m + 1):
+            if p[j]:
+                assignment[p[j]-1] = j - 1
+                cost += distances[p[j]-1][j-1]
+
+        return assignment, cost
@@ -0,0 +1,159 @@
+""" Raw IR capture files
+
+A capture is a small header followed by fixed-size little-endian records,
+one per cwiid IR message, so a file can be memory-mapped as a NumPy array
+
+    header: 'HSSIR' + version (1 byte) + 2 padding bytes
+    record: RECORD_DTYPE (timestamp, then one slot per IR source)
+"""
+import sys
+import time as clock
+import argparse
+
+import numpy as np
+
+MAGIC = b'HSSIR'
+VERSION = 1
+HEADER = MAGIC + bytearray([VERSION, 0, 0])
+
+IR_SLOTS = 4
+
+RECORD_DTYPE = np.dtype([
+    ('time', '<f8'),
+    ('valid', 'u1', (IR_SLOTS,)),
+    ('pos', '<i2', (IR_SLOTS, 2)),
+    ('size', '<i2', (IR_SLOTS,)),
+])
+
+
+class IRRecorder():
+    """
+    Appends raw cwiid IR messages to a capture file
+    A single record buffer is reused for every message
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(bytes(HEADER))
+
+        self.record_buffer = np.zeros(1, dtype=RECORD_DTYPE)
+        self.records = 0
+
+    def record(self, mesg, time):
+        """ mesg: cwiid IR message, (cwiid.MESG_IR, sources) """
+        record = self.record_buffer[0]
+        record['time'] = time
+        record['valid'] = 0
+
+        for (i, source) in enumerate(mesg[1][:IR_SLOTS]):
+            if source is not None:
+                record['valid'][i] = 1
+                record['pos'][i] = source['pos']
+                record['size'][i] = source['size']
+
+        self.file.write(self.record_buffer.tobytes())
+        self.records += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def load_recording(path):
+    """ Memory-maps a capture file as an array of RECORD_DTYPE """
+    with open(path, 'rb') as f:
+        header = bytearray(f.read(len(HEADER)))
+
+    if bytes(header[:len(MAGIC)]) != MAGIC:
+        raise ValueError("%s is not an IR capture file" % path)
+    if header[len(MAGIC)] != VERSION:
+        raise ValueError("Unsupported IR capture version %d" % header[len(MAGIC)])
+
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=len(HEADER))
+
+
+def as_frames(records):
+    """
+    Converts capture records to the (times, sources) arrays
+    expected by Tracker.receive_batch
+    """
+    sources = np.ma.empty((len(records), IR_SLOTS, 3), dtype=int)
+    sources[..., :2] = records['pos']
+    sources[..., 2] = records['size']
+    sources[~records['valid'].astype(bool)] = np.ma.masked
+
+    return np.asarray(records['time']), sources
+
+
+def as_mesg_sources(record):
+    """ Rebuilds the cwiid source list of a single record """
+    return [
+        {'pos': tuple(int(c) for c in record['pos'][i]), 'size': int(record['size'][i])}
+        if record['valid'][i] else None
+        for i in range(IR_SLOTS)
+    ]
+
+
+def replay(records, tracker, speed=None):
+    """
+    Feeds capture records into tracker.receive
+
+    speed: None replays as fast as possible, otherwise the
+        recorded timing is scaled (2.0 replays twice as fast)
+
+    Returns (frames, elapsed wall-clock seconds)
+    """
+    start = clock.time()
+    first = records[0]['time'] if len(records) else 0
+
+    for record in records:
+        if speed is not None:
+            delay = (record['time'] - first) / speed - (clock.time() - start)
+            if delay > 0:
+                clock.sleep(delay)
+
+        tracker.receive(as_mesg_sources(record), float(record['time']))
+
+    return len(records), clock.time() - start
+
+
+def main():
+    ''' replaying needs no device, cwiid is simulated where missing '''
+    import simulator
+    cwiid = simulator.install()
+
+    import logger as logging
+    from tracker import Tracker
+
+    parser = argparse.ArgumentParser(description="Replays a raw IR capture into a Tracker")
+    parser.add_argument('capture')
+    parser.add_argument('--speed', type=float, default=None,
+        help="real-time scale factor (default: as fast as possible)")
+    parser.add_argument('--batch', action='store_true',
+        help="use Tracker.receive_batch instead of per-message receive")
+    parser.add_argument('--puck-height', type=float, default=0.9)
+    parser.add_argument('--sensitivity', type=float, default=25)
+    parser.add_argument('--stick-height', type=float, default=150)
+    parser.add_argument('--camera-rotation', type=int, default=180)
+    args = parser.parse_args()
+
+    tracker = Tracker(args.puck_height * cwiid.IR_Y_MAX,
+        puck_proximity=args.sensitivity,
+        stick_height=args.stick_height,
+        camera_rotation=args.camera_rotation,
+        log_level=logging.OFF)
+
+    records = load_recording(args.capture)
+
+    if args.batch:
+        start = clock.time()
+        tracker.receive_batch(*as_frames(records))
+        frames, elapsed = len(records), clock.time() - start
+    else:
+        frames, elapsed = replay(records, tracker, speed=args.speed)
+
+    sys.stdout.write("%d frames in %.3fs (%.1f frames/s), %d shots\n" % (
+        frames, elapsed, frames / max(elapsed, 1e-9), tracker.shoot_counter))
+
+main() if __name__ == '__main__' else True
@@ -0,0 +1,212 @@
+""" Headless multi-station server
+
+Runs one Tracker per shooting station in a single host
+
+    python server.py --station NAME[=BDADDR] [--station ...] [--simulate N]
+
+Device callbacks only enqueue IR reports into the station's bounded
+queue; a worker thread per station runs Tracker.receive and writes
+its session log, so a busy station never stalls another's callbacks
+(when a queue is full the oldest report is dropped)
+"""
+import os
+import threading
+import argparse
+import time as clock
+from datetime import datetime
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import logger as logging
+from session_log import open_session_log, FREE_SHOOT
+logger = logging.Logger()
+
+
+class Station():
+    def __init__(self, name, tracker, queue_size=256):
+        self.name = name
+        self.tracker = tracker
+        self.device = None
+        self.output_log = None
+
+        self.reports = queue.Queue(maxsize=queue_size)
+        self.worker = threading.Thread(target=self._work, name="station-%s" % name)
+        self.worker.daemon = True
+        self.running = False
+
+        """ stats """
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def attach(self, device, output_dir=None, log_format='text', trajectory=None, log_options=None):
+        """ starts tracking reports of device (and logging them to output_dir) """
+        from capture import configure_wiimote, high_callback
+
+        if output_dir is not None:
+            present = datetime.now()
+            self.output_log = open_session_log(os.path.join(output_dir,
+                "%s-%s" % (self.name, present.strftime("%y%m%d%H%M%S"))),
+                FREE_SHOOT, fmt=log_format, trajectory=trajectory, background=True, **(log_options or {}))
+            self.tracker.set_logging_point(self.output_log)
+
+        self.running = True
+        self.worker.start()
+
+        self.device = configure_wiimote(device)
+        self.device.mesg_callback = high_callback(
+            lambda mesg, time: self.enqueue(mesg[1], time),
+            on_error=self.device_error)
+
+    def enqueue(self, sources, time):
+        """ device callback side, never blocks """
+        self.received += 1
+        self._put((sources, time))
+
+    def _put(self, report):
+        while True:
+            try:
+                self.reports.put_nowait(report)
+                return
+            except queue.Full:
+                try:
+                    self.reports.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def device_error(self, mesg, time):
+        self.errors += 1
+        logger.error("Station %s: error message received from Wiimote", self.name)
+
+    def stop(self):
+        self.running = False
+        self._put((None, None))
+        self.worker.join()
+
+        if self.device is not None:
+            self.device.close()
+
+        if self.output_log is not None:
+            self.output_log.end(self.tracker.session_time())
+            self.output_log.close()
+            self.output_log = None
+
+    def _work(self):
+        while self.running:
+            sources, time = self.reports.get()
+            if sources is None:
+                break
+
+            self.tracker.receive(sources, time)
+            self.processed += 1
+
+
+class StationServer():
+    def __init__(self, report_interval=5.0, log_format='text', trajectory=None, log_options=None):
+        """ log_options: max_bytes / compress of text logs, see session_log.open_session_log """
+        self.stations = []
+        self.report_interval = report_interval
+        self.log_format = log_format
+        self.trajectory = trajectory
+        self.log_options = log_options or {}
+        self.stopping = threading.Event()
+
+    def add(self, station, device, output_dir=None):
+        self.stations.append(station)
+        station.attach(device, output_dir, self.log_format, self.trajectory, self.log_options)
+
+    def report(self, elapsed, last):
+        for station in self.stations:
+            processed = station.processed - last.get(station.name, 0)
+            last[station.name] = station.processed
+
+            logger.info("%-10s %7.1f frames/s  queue %3d  dropped %d  errors %d  shots %d",
+                station.name, processed / elapsed, station.reports.qsize(),
+                station.dropped, station.errors, station.tracker.shoot_counter)
+
+    def serve(self):
+        """ blocks until stop() (or Ctrl+C), reporting per-station stats """
+        last = {}
+        previous = clock.time()
+
+        try:
+            while not self.stopping.wait(self.report_interval):
+                now = clock.time()
+                self.report(now - previous, last)
+                previous = now
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for station in self.stations:
+                station.stop()
+
+    def stop(self):
+        self.stopping.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless multi-station server")
+    parser.add_argument('--station', action='append', default=[],
+        help="NAME[=BDADDR] of a Wiimote station")
+    parser.add_argument('--simulate', type=int, default=0,
+        help="number of additional simulated stations")
+    parser.add_argument('--output', default='output',
+        help="session log directory")
+    parser.add_argument('--log-format', choices=('text', 'binary'), default='text',
+        help="session log format (.test or .hsl)")
+    parser.add_argument('--trajectories', choices=('npy', 'npz'), default=None,
+        help="also export columnar trajectories (see trajectory)")
+    parser.add_argument('--rotate-bytes', type=int, default=None,
+        help="rotate text session logs every ROTATE_BYTES")
+    parser.add_argument('--compress', action='store_true',
+        help="gzip text session logs")
+    parser.add_argument('--report-interval', type=float, default=5.0)
+    parser.add_argument('--puck-height', type=float, default=0.9)
+    parser.add_argument('--sensitivity', type=float, default=25)
+    parser.add_argument('--stick-height', type=float, default=150)
+    parser.add_argument('--camera-rotation', type=int, default=180)
+    args = parser.parse_args()
+
+    if args.simulate:
+        import simulator
+        simulator.install()
+
+    import cwiid
+    from tracker import Tracker
+
+    def new_tracker():
+        return Tracker(args.puck_height * cwiid.IR_Y_MAX,
+            puck_proximity=args.sensitivity,
+            stick_height=args.stick_height,
+            camera_rotation=args.camera_rotation,
+            log_level=logging.OFF)
+
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+
+    server = StationServer(report_interval=args.report_interval,
+        log_format=args.log_format, trajectory=args.trajectories,
+        log_options={'max_bytes': args.rotate_bytes, 'compress': args.compress})
+
+    for spec in args.station:
+        name, _, bdaddr = spec.partition('=')
+        logger.info("Station %s: put its Wiimote in discoverable mode (press 1+2)", name)
+        device = cwiid.Wiimote(bdaddr) if bdaddr else cwiid.Wiimote()
+        server.add(Station(name, new_tracker()), device, args.output)
+
+    for i in range(args.simulate):
+        device = simulator.SimulatedWiimote(simulator.swing_stream(
+            swings=int(1e6), camera_rotation=args.camera_rotation, seed=i))
+        server.add(Station("sim%d" % i, new_tracker()), device, args.output)
+
+    if not server.stations:
+        parser.error("no stations configured")
+
+    server.serve()
+
+main() if __name__ == '__main__' else True
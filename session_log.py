@@ -0,0 +1,387 @@
+""" Session logs
+
+A session log records what a Tracker saw during a play: tracked frames,
+calibrations, shots and lost-track events. Two formats share the same
+sink interface (event, frame, end, close):
+
+TextSessionLog writes the original free-text .test format
+
+    Starting free shoot
+    Calibrating [0.52]
+    512 212 0 511 392 0  [0.53]
+    ...
+    Ending play after 42.0
+
+BinarySessionLog writes typed fixed-size records (.hsl), memory-mappable
+as a NumPy array and parseable without string scanning
+
+    header  : 'HSSLOG' + version (u1) + session kind (u1) + start time (f8)
+    records : RECORD_DTYPE, one per frame or event
+    index   : record numbers (u4) of every non-frame record
+    trailer : 'HSSIDX\\0\\0' + record count (u8) + index length (u8)
+
+The index and trailer are written on close; a log that was not closed
+is still readable, its index is rebuilt from the records
+
+Both can write through a log_writer.BackgroundWriter, keeping disk
+writes out of the tracking thread (open_session_log(background=True))
+
+TeeSessionLog forwards to several sinks, e.g. a log and a columnar
+trajectory export (see trajectory)
+"""
+import re
+import sys
+import gzip
+import struct
+import argparse
+import time as clock
+from datetime import datetime
+
+import numpy as np
+
+from log_writer import BackgroundWriter, segment_paths
+
+""" record types """
+FRAME = 0
+CALIBRATION = 1
+SHOT_START = 2
+SHOT_END = 3
+LOST_TRACK = 4
+SESSION_END = 5
+
+""" session kinds """
+UNKNOWN_SESSION = 0
+FREE_SHOOT = 1
+SHOOT_TEN = 2
+
+EVENT_MESSAGES = {
+    CALIBRATION: "Calibrating",
+    SHOT_START: "Shoot started",
+    SHOT_END: "Shoot ended",
+    LOST_TRACK: "Lost track!",
+}
+
+SESSION_MESSAGES = {
+    FREE_SHOOT: "Starting free shoot",
+    SHOOT_TEN: "Starting shoot 10",
+}
+
+TRACKED_POINTS = 2
+
+MAGIC = b'HSSLOG'
+VERSION = 1
+HEADER = struct.Struct('<6sBBd')
+
+INDEX_MAGIC = b'HSSIDX\0\0'
+TRAILER = struct.Struct('<8sQQ')
+
+RECORD_DTYPE = np.dtype([
+    ('type', 'u1'),
+    ('state', 'S1'),
+    ('points', '<i2', (TRACKED_POINTS, 3)), # (x, y, z) per tracked point
+    ('time', '<f8'), # seconds since session start
+])
+
+
+def write_always(logfile, data):
+    """ writes data even when logfile is a BackgroundWriter falling behind (without blocking) """
+    if isinstance(logfile, BackgroundWriter):
+        logfile.write(data, always=True)
+    else:
+        logfile.write(data)
+
+
+class TextSessionLog():
+    """
+    Free-text .test session log
+    Through a BackgroundWriter frames may be dropped under disk stalls,
+    events and the play end never are
+    """
+    def __init__(self, logfile, kind=UNKNOWN_SESSION):
+        self.logfile = logfile
+        self.start = datetime.now()
+
+        if kind in SESSION_MESSAGES:
+            write_always(self.logfile, SESSION_MESSAGES[kind] + " \n")
+
+    def elapsed(self):
+        return (datetime.now() - self.start).total_seconds()
+
+    def event(self, kind, time=None):
+        write_always(self.logfile, "%s [%s]\n" % (EVENT_MESSAGES[kind],
+            time if time is not None else self.elapsed()))
+
+    def frame(self, state, points, time=None, touching=None):
+        self.logfile.write("%s [%s]\n" % (
+            ''.join("%d %d %d " % (p[0], p[1], p[2]) for p in points),
+            time if time is not None else self.elapsed()))
+
+    def end(self, time=None):
+        write_always(self.logfile, "Ending play after %s\n" % (
+            time if time is not None else self.elapsed()))
+
+    def close(self):
+        self.logfile.close()
+
+
+class BinarySessionLog():
+    """ Typed fixed-record .hsl session log """
+    def __init__(self, path, kind=UNKNOWN_SESSION, file=None):
+        """
+        file: where to write instead of opening path, e.g. a
+            log_writer.BackgroundWriter: frames may then be dropped under
+            disk stalls, so record numbers of the index and trailer come
+            from what the writer actually wrote (its offsets)
+        """
+        self.file = file if file is not None else open(path, 'wb')
+        self.background = isinstance(self.file, BackgroundWriter)
+        self.start = clock.time()
+        write_always(self.file, HEADER.pack(MAGIC, VERSION, kind, self.start))
+
+        self.record_buffer = np.zeros(1, dtype=RECORD_DTYPE)
+        self.records = 0
+        self.index = []
+
+    def elapsed(self):
+        return clock.time() - self.start
+
+    def event(self, kind, time=None):
+        self._write(kind, b'', (), time, indexed=True)
+
+    def frame(self, state, points, time=None, touching=None):
+        self._write(FRAME, state, points, time)
+
+    def end(self, time=None):
+        self._write(SESSION_END, b'', (), time, indexed=True)
+
+    def close(self):
+        if self.file is None:
+            return
+
+        if self.background:
+            ''' numbers what reached the file, dropped frames left out '''
+            self.file.flush()
+            self.records = max(0, self.file.written - HEADER.size) // RECORD_DTYPE.itemsize
+            self.index = [(offset - HEADER.size) // RECORD_DTYPE.itemsize for offset in self.file.offsets]
+
+        write_always(self.file, np.array(self.index, dtype='<u4').tobytes())
+        write_always(self.file, TRAILER.pack(INDEX_MAGIC, self.records, len(self.index)))
+        self.file.close()
+        self.file = None
+
+    def _write(self, kind, state, points, time, indexed=False):
+        record = self.record_buffer[0]
+        record['type'] = kind
+        record['state'] = state
+        record['points'] = 0
+        for (k, p) in enumerate(points[:TRACKED_POINTS]):
+            record['points'][k] = p
+        record['time'] = time if time is not None else self.elapsed()
+
+        if self.background:
+            ''' events are never dropped, the writer notes where they land '''
+            self.file.write(self.record_buffer.tobytes(), always=indexed, offset=indexed)
+            return
+
+        if indexed:
+            self.index.append(self.records)
+        self.file.write(self.record_buffer.tobytes())
+        self.records += 1
+
+
+class TeeSessionLog():
+    """ Forwards everything to several session logs """
+    def __init__(self, *logs):
+        self.logs = logs
+
+    def event(self, kind, time=None):
+        for log in self.logs:
+            log.event(kind, time)
+
+    def frame(self, state, points, time=None, touching=None):
+        for log in self.logs:
+            log.frame(state, points, time, touching)
+
+    def end(self, time=None):
+        for log in self.logs:
+            log.end(time)
+
+    def close(self):
+        for log in self.logs:
+            log.close()
+
+
+def open_session_log(path, kind=UNKNOWN_SESSION, fmt='text', trajectory=None,
+        background=False, max_bytes=None, compress=False):
+    """
+    path without extension, fmt is 'text' (.test) or 'binary' (.hsl)
+    trajectory: also exports columnar trajectories, 'npy' or 'npz' (see trajectory)
+    background: writes from a background thread (see log_writer),
+        text logs can also be rotated every max_bytes and gzip-compressed
+    """
+    if fmt == 'binary' and (max_bytes is not None or compress):
+        raise ValueError("Binary session logs cannot be rotated or compressed")
+
+    if fmt == 'binary':
+        target = path + '.hsl'
+        log = BinarySessionLog(target, kind,
+            file=BackgroundWriter(target) if background else None)
+    else:
+        target = path + '.test'
+        log = TextSessionLog(BackgroundWriter(target, max_bytes, compress)
+            if background or max_bytes is not None or compress else open(target, 'w'), kind)
+
+    if trajectory is not None:
+        from trajectory import TrajectoryLog
+        log = TeeSessionLog(log, TrajectoryLog(path, kind, fmt=trajectory))
+
+    return log
+
+
+""" Reading """
+def read_session_log(path):
+    """
+    Returns (kind, start timestamp, records, index)
+        records: memory-mapped RECORD_DTYPE array
+        index: record numbers of every non-frame record
+    """
+    with open(path, 'rb') as f:
+        magic, version, kind, start = HEADER.unpack(f.read(HEADER.size))
+
+        if magic != MAGIC:
+            raise ValueError("%s is not a binary session log" % path)
+        if version != VERSION:
+            raise ValueError("Unsupported session log version %d" % version)
+
+        f.seek(0, 2)
+        size = f.tell()
+
+        trailer = None
+        if size >= HEADER.size + TRAILER.size:
+            f.seek(size - TRAILER.size)
+            trailer = TRAILER.unpack(f.read(TRAILER.size))
+
+    if trailer is not None and trailer[0] == INDEX_MAGIC \
+            and size == HEADER.size + trailer[1] * RECORD_DTYPE.itemsize + trailer[2] * 4 + TRAILER.size:
+        _, count, index_length = trailer
+        records = np.memmap(path, dtype=RECORD_DTYPE, mode='r',
+            offset=HEADER.size, shape=(count,)) if count else np.zeros(0, dtype=RECORD_DTYPE)
+        index = np.memmap(path, dtype='<u4', mode='r',
+            offset=HEADER.size + count * RECORD_DTYPE.itemsize, shape=(index_length,)) \
+            if index_length else np.zeros(0, dtype='<u4')
+    else:
+        """ not closed (or truncated), rebuilds index """
+        end = size
+        if trailer is not None and trailer[0] == INDEX_MAGIC:
+            """ trailer disagrees with the file size, skips trailer and index """
+            end = max(HEADER.size, size - TRAILER.size - trailer[2] * 4)
+
+        count = (end - HEADER.size) // RECORD_DTYPE.itemsize
+        records = np.memmap(path, dtype=RECORD_DTYPE, mode='r',
+            offset=HEADER.size, shape=(count,)) if count else np.zeros(0, dtype=RECORD_DTYPE)
+        index = np.flatnonzero(records['type'] != FRAME)
+
+    return kind, start, records, index
+
+
+def iter_events(path):
+    """ (event type, time) pairs of every non-frame record, in order """
+    kind, start, records, index = read_session_log(path)
+    events = records[index]
+
+    return zip(events['type'].tolist(), events['time'].tolist())
+
+
+""" Conversion """
+TEXT_LINE = re.compile(r'^(?P<message>.*?)\s*\[(?P<time>[-+0-9.e]+)\]\s*$')
+TEXT_EVENTS = dict((message, kind) for (kind, message) in EVENT_MESSAGES.items())
+TEXT_SESSIONS = dict((message, kind) for (kind, message) in SESSION_MESSAGES.items())
+TEXT_STATES = {CALIBRATION: b'W', SHOT_START: b'S', SHOT_END: b'U', LOST_TRACK: b'U'}
+
+
+def text_log_stem(text_path):
+    """ path of a (possibly gzipped) .test log without its extensions """
+    if text_path.endswith('.gz'):
+        text_path = text_path[:-len('.gz')]
+    return text_path[:-len('.test')] if text_path.endswith('.test') else text_path
+
+
+def text_log_lines(text_path):
+    """ lines of a .test log, across its rotated and gzipped segments (see log_writer) """
+    segments = segment_paths(text_path[:-len('.gz')] if text_path.endswith('.gz') else text_path)
+
+    for segment in segments or [text_path]:
+        with (gzip.open(segment, 'rt') if segment.endswith('.gz') else open(segment)) as f:
+            for line in f:
+                yield line
+
+
+def read_text_log(text_path):
+    """
+    Parses an existing .test log, rotated and gzipped ones included
+    Returns (kind, records), records is a RECORD_DTYPE array
+    """
+    lines = list(text_log_lines(text_path))
+
+    kind = UNKNOWN_SESSION
+    if lines and lines[0].strip() in TEXT_SESSIONS:
+        kind = TEXT_SESSIONS[lines[0].strip()]
+
+    records = []
+    no_points = [[0, 0, 0]] * TRACKED_POINTS
+    state = b'U'
+
+    for line in lines:
+        if line.startswith('Ending play after'):
+            records.append((SESSION_END, b'', no_points, float(line[len('Ending play after'):])))
+            continue
+
+        match = TEXT_LINE.match(line)
+        if match is None:
+            continue
+
+        message, time = match.group('message'), float(match.group('time'))
+
+        if message in TEXT_EVENTS:
+            event = TEXT_EVENTS[message]
+            records.append((event, b'', no_points, time))
+            state = TEXT_STATES[event]
+        else:
+            values = [int(v) for v in message.split()]
+            points = [values[i:i+3] for i in range(0, len(values) - 2, 3)][:TRACKED_POINTS]
+            records.append((FRAME, state, points + no_points[len(points):], time))
+
+    return kind, np.array(records, dtype=RECORD_DTYPE)
+
+
+def convert_text_log(text_path, binary_path):
+    """ Converts an existing .test log into a binary session log """
+    kind, records = read_text_log(text_path)
+
+    log = BinarySessionLog(binary_path, kind)
+
+    for record in records:
+        record_type, time = record['type'], float(record['time'])
+
+        if record_type == FRAME:
+            log.frame(record['state'], record['points'], time)
+        elif record_type == SESSION_END:
+            log.end(time)
+        else:
+            log.event(record_type, time)
+
+    log.close()
+    return log.records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts .test session logs to binary .hsl logs")
+    parser.add_argument('logs', nargs='+')
+    args = parser.parse_args()
+
+    for path in args.logs:
+        target = text_log_stem(path) + '.hsl'
+        records = convert_text_log(path, target)
+        sys.stdout.write("%s -> %s (%d records)\n" % (path, target, records))
+
+main() if __name__ == '__main__' else True
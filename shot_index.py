@@ -0,0 +1,240 @@
+""" SQLite index of session logs
+
+Keeps the shots, calibrations and lost-track events of every parsed
+session in a local SQLite database, so cross-session questions are a
+query instead of a pass over every log
+
+    python shot_index.py ingest output
+    python shot_index.py shots --min-duration 0.8 --since 2026-09-01
+    python shot_index.py sessions --min-loses 5
+
+Ingestion is incremental: a log is parsed again only when its size or
+modification time (over all its rotated segments) changed since it was indexed
+
+Times are seconds since the session start, except session starts and
+shot / event 'at' columns which are timestamps (see shot_stats.session_start)
+"""
+import os
+import sys
+import sqlite3
+import argparse
+import time as clock
+
+import session_log
+from log_writer import segments_signature
+from log_parser import log_files, analyze_paths, print_progress
+from shot_stats import session_start
+
+DEFAULT_DATABASE = 'shot_index.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    start REAL NOT NULL,
+    total_time REAL,
+    shots INTEGER NOT NULL,
+    calibrations INTEGER NOT NULL,
+    loses INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shots (
+    session INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    start REAL NOT NULL,
+    finish REAL NOT NULL,
+    duration REAL NOT NULL,
+    at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    session INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    type INTEGER NOT NULL,
+    time REAL NOT NULL,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_start ON sessions(start);
+CREATE INDEX IF NOT EXISTS sessions_loses ON sessions(loses);
+CREATE INDEX IF NOT EXISTS shots_session ON shots(session);
+CREATE INDEX IF NOT EXISTS shots_duration ON shots(duration);
+CREATE INDEX IF NOT EXISTS shots_at ON shots(at);
+CREATE INDEX IF NOT EXISTS events_session ON events(session);
+CREATE INDEX IF NOT EXISTS events_type_at ON events(type, at);
+"""
+
+
+def parse_date(date):
+    """ 'YYYY-MM-DD' (local time) as a timestamp """
+    return clock.mktime(clock.strptime(date, '%Y-%m-%d'))
+
+
+class ShotIndex():
+    def __init__(self, path=DEFAULT_DATABASE):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    """ Ingestion """
+    def ingest(self, directory, workers=None, progress=None, failed=None):
+        """
+        Indexes new and modified session logs of directory, forgets
+        indexed logs of directory that were deleted
+        failed: optional list, gets the (path, error message) of unreadable logs
+        Returns (indexed, removed) session counts
+        """
+        paths = [os.path.abspath(path) for path in log_files(directory)]
+        known = dict((path, (size, mtime)) for (path, size, mtime) in self.db.execute(
+            "SELECT path, size, mtime FROM sessions"))
+
+        signatures = dict((path, segments_signature(path)) for path in paths)
+
+        changed = [path for path in paths if known.get(path) != signatures[path]]
+
+        prefix = os.path.join(os.path.abspath(directory), '')
+        removed = [path for path in known
+            if path.startswith(prefix) and path not in signatures]
+
+        results = analyze_paths(changed, workers=workers, progress=progress, failed=failed) if changed else []
+
+        with self.db:
+            for path in removed:
+                self.db.execute("DELETE FROM sessions WHERE path = ?", (path,))
+
+            for (path, stats, meta) in results:
+                self._insert(path, signatures[path], stats)
+
+        return len(results), len(removed)
+
+    def _insert(self, path, signature, stats):
+        self.db.execute("DELETE FROM sessions WHERE path = ?", (path,))
+
+        total_time = stats.get('total_time')
+        start = session_start(path, total_time)
+
+        session = self.db.execute(
+            "INSERT INTO sessions (path, size, mtime, start, total_time, shots, calibrations, loses)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, signature[0], signature[1], start, total_time,
+                len(stats['shoots']), len(stats['calibrations']), len(stats['loses']))).lastrowid
+
+        self.db.executemany("INSERT INTO shots VALUES (?, ?, ?, ?, ?)", [
+            (session, shoot['start'], shoot['end'], shoot['end'] - shoot['start'], start + shoot['start'])
+            for shoot in stats['shoots']])
+
+        self.db.executemany("INSERT INTO events VALUES (?, ?, ?, ?)",
+            [(session, session_log.CALIBRATION, time, start + time) for time in stats['calibrations']]
+            + [(session, session_log.LOST_TRACK, time, start + time) for time in stats['loses']])
+
+    """ Queries """
+    def shots(self, min_duration=None, max_duration=None, since=None, until=None):
+        """ (path, shot timestamp, duration) of matching shots, oldest first """
+        conditions, arguments = self._conditions((
+            ('shots.duration >= ?', min_duration),
+            ('shots.duration <= ?', max_duration),
+            ('shots.at >= ?', since),
+            ('shots.at < ?', until),
+        ))
+
+        return self.db.execute(
+            "SELECT sessions.path, shots.at, shots.duration"
+            " FROM shots JOIN sessions ON shots.session = sessions.id"
+            + conditions + " ORDER BY shots.at", arguments).fetchall()
+
+    def sessions(self, min_shots=None, min_calibrations=None, min_loses=None, since=None, until=None):
+        """ (path, start, total time, shots, calibrations, loses) of matching sessions, oldest first """
+        conditions, arguments = self._conditions((
+            ('shots >= ?', min_shots),
+            ('calibrations >= ?', min_calibrations),
+            ('loses >= ?', min_loses),
+            ('start >= ?', since),
+            ('start < ?', until),
+        ))
+
+        return self.db.execute(
+            "SELECT path, start, total_time, shots, calibrations, loses FROM sessions"
+            + conditions + " ORDER BY start", arguments).fetchall()
+
+    def events(self, kind, since=None, until=None):
+        """ (path, timestamp, session time) of kind events (session_log types), oldest first """
+        conditions, arguments = self._conditions((
+            ('events.type = ?', kind),
+            ('events.at >= ?', since),
+            ('events.at < ?', until),
+        ))
+
+        return self.db.execute(
+            "SELECT sessions.path, events.at, events.time"
+            " FROM events JOIN sessions ON events.session = sessions.id"
+            + conditions + " ORDER BY events.at", arguments).fetchall()
+
+    """ Internal Methods """
+    def _conditions(self, filters):
+        """ WHERE clause and arguments of the (condition, value) pairs whose value is set """
+        filters = [(condition, value) for (condition, value) in filters if value is not None]
+        if not filters:
+            return "", ()
+
+        return (" WHERE " + " AND ".join(condition for (condition, value) in filters),
+            tuple(value for (condition, value) in filters))
+
+
+def format_time(timestamp):
+    return clock.strftime('%Y-%m-%d %H:%M:%S', clock.localtime(timestamp))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite index of session logs")
+    parser.add_argument('--db', default=DEFAULT_DATABASE, help="index database")
+    commands = parser.add_subparsers(dest='command')
+
+    ingest = commands.add_parser('ingest', help="index new and modified logs of a directory")
+    ingest.add_argument('directory', nargs='?', default='output')
+    ingest.add_argument('--workers', type=int, default=None)
+    ingest.add_argument('--quiet', action='store_true', help="no progress report")
+
+    shots = commands.add_parser('shots', help="list shots")
+    shots.add_argument('--min-duration', type=float, default=None)
+    shots.add_argument('--max-duration', type=float, default=None)
+
+    sessions = commands.add_parser('sessions', help="list sessions")
+    sessions.add_argument('--min-shots', type=int, default=None)
+    sessions.add_argument('--min-calibrations', type=int, default=None)
+    sessions.add_argument('--min-loses', type=int, default=None)
+
+    for command in (shots, sessions):
+        command.add_argument('--since', type=parse_date, default=None, help="YYYY-MM-DD")
+        command.add_argument('--until', type=parse_date, default=None, help="YYYY-MM-DD (excluded)")
+
+    args = parser.parse_args()
+    index = ShotIndex(args.db)
+
+    try:
+        if args.command == 'ingest':
+            failed = []
+            indexed, removed = index.ingest(args.directory, workers=args.workers,
+                progress=None if args.quiet else print_progress, failed=failed)
+            for (path, error) in failed:
+                sys.stderr.write("skipped %s (%s)\n" % (path, error))
+            sys.stdout.write("%d sessions indexed, %d removed\n" % (indexed, removed))
+
+        elif args.command == 'shots':
+            for (path, at, duration) in index.shots(args.min_duration, args.max_duration,
+                    args.since, args.until):
+                sys.stdout.write("%s %7.3f %s\n" % (format_time(at), duration, path))
+
+        elif args.command == 'sessions':
+            for (path, start, total_time, shots, calibrations, loses) in index.sessions(
+                    args.min_shots, args.min_calibrations, args.min_loses, args.since, args.until):
+                sys.stdout.write("%s %8s %3d shoots %3d calibrations %3d loses %s\n" % (
+                    format_time(start), "%.1f" % total_time if total_time is not None else '-',
+                    shots, calibrations, loses, path))
+
+        else:
+            parser.error("a command is required")
+    finally:
+        index.close()
+
+main() if __name__ == '__main__' else True
@@ -0,0 +1,188 @@
+""" Cross-session shot statistics
+
+Flattens log_parser results of many sessions into NumPy arrays, one
+entry per session and one per completed shot, so distributions and
+rollups are computed in bulk rather than per session dict
+
+    table = ShotTable(log_parser.analyze_directory('output'))
+    table.duration_percentiles()
+    table.per_day()
+"""
+import os
+import time as clock
+
+import numpy as np
+
+import session_log
+
+PERCENTILES = (5, 25, 50, 75, 95)
+HISTOGRAM_BINS = 20
+
+
+def session_start(path, total_time=None):
+    """
+    Start timestamp of a session log: stored in .hsl headers, estimated
+    as last modification - total time for .test logs
+    """
+    if path.endswith('.hsl'):
+        with open(path, 'rb') as f:
+            return session_log.HEADER.unpack(f.read(session_log.HEADER.size))[3]
+
+    return os.path.getmtime(path) - (total_time or 0)
+
+
+class ShotTable():
+    """
+    Session arrays (one entry per session, in results order)
+        paths, starts, total_times (NaN when the play did not end),
+        shot_counts, calibrations, loses
+    Shot arrays (one entry per completed shot)
+        shot_sessions (session index), shot_starts, shot_durations
+    """
+    def __init__(self, results, starts=None):
+        """
+        results: (path, stats, meta) tuples, see log_parser.analyze_directory
+        starts: session start timestamps (default: session_start of each path)
+        """
+        self.paths = [path for (path, stats, meta) in results]
+        sessions = len(self.paths)
+
+        self.total_times = np.array([stats.get('total_time', np.nan)
+            for (path, stats, meta) in results], dtype=float).reshape(sessions)
+        self.calibrations = np.array([len(stats['calibrations'])
+            for (path, stats, meta) in results], dtype=int).reshape(sessions)
+        self.loses = np.array([len(stats['loses'])
+            for (path, stats, meta) in results], dtype=int).reshape(sessions)
+
+        shoots = [stats['shoots'] for (path, stats, meta) in results]
+        self.shot_counts = np.array([len(s) for s in shoots], dtype=int).reshape(sessions)
+        self.shot_sessions = np.repeat(np.arange(sessions), self.shot_counts)
+
+        bounds = np.array([(shoot['start'], shoot['end'])
+            for s in shoots for shoot in s], dtype=float).reshape(-1, 2)
+        self.shot_starts = bounds[:, 0]
+        self.shot_durations = bounds[:, 1] - bounds[:, 0]
+
+        if starts is None:
+            starts = [session_start(path, None if np.isnan(total) else total)
+                for (path, total) in zip(self.paths, self.total_times)]
+        self.starts = np.array(starts, dtype=float).reshape(sessions)
+
+    def __len__(self):
+        return len(self.paths)
+
+    """ Distributions """
+    def duration_percentiles(self, percentiles=PERCENTILES):
+        """ {percentile: shot duration}, NaN without shots """
+        if not len(self.shot_durations):
+            return dict((p, np.nan) for p in percentiles)
+
+        return dict(zip(percentiles, np.percentile(self.shot_durations, percentiles).tolist()))
+
+    def duration_histogram(self, bins=HISTOGRAM_BINS, range=None):
+        """ (counts, bin edges) of shot durations, see np.histogram """
+        return np.histogram(self.shot_durations, bins=bins, range=range)
+
+    """ Per-session """
+    def time_to_first_shot(self):
+        """ start of the earliest shot of each session, NaN without shots """
+        first = np.full(len(self), np.inf)
+        np.minimum.at(first, self.shot_sessions, self.shot_starts)
+        first[np.isinf(first)] = np.nan
+
+        return first
+
+    def rates(self):
+        """ (calibrations, lost tracks) per minute of each session, NaN if it did not end """
+        minutes = self.total_times / 60.0
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.calibrations / minutes, self.loses / minutes
+
+    def per_session(self):
+        """ dict of per-session arrays """
+        sessions = len(self)
+        duration_sum = np.bincount(self.shot_sessions, weights=self.shot_durations, minlength=sessions)
+
+        duration_min = np.full(sessions, np.inf)
+        duration_max = np.full(sessions, -np.inf)
+        np.minimum.at(duration_min, self.shot_sessions, self.shot_durations)
+        np.maximum.at(duration_max, self.shot_sessions, self.shot_durations)
+
+        no_shots = self.shot_counts == 0
+        duration_min[no_shots] = np.nan
+        duration_max[no_shots] = np.nan
+
+        calibration_rate, lose_rate = self.rates()
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            duration_mean = duration_sum / self.shot_counts
+
+        return {
+            'path': np.array(self.paths),
+            'start': self.starts,
+            'total_time': self.total_times,
+            'shots': self.shot_counts,
+            'shot_mean_time': duration_mean,
+            'shot_min_time': duration_min,
+            'shot_max_time': duration_max,
+            'calibrations': self.calibrations,
+            'loses': self.loses,
+            'calibration_rate': calibration_rate,
+            'lose_rate': lose_rate,
+            'time_to_first_shot': self.time_to_first_shot(),
+        }
+
+    """ Rollups """
+    def days(self):
+        """ local 'YYYY-MM-DD' day of each session """
+        return np.array([clock.strftime('%Y-%m-%d', clock.localtime(start)) for start in self.starts])
+
+    def per_day(self):
+        """ dict of per-day arrays, days in ascending order """
+        days, session_days = np.unique(self.days(), return_inverse=True)
+        shot_days = session_days[self.shot_sessions]
+        count = len(days)
+
+        def total(weights):
+            return np.bincount(session_days, weights=weights, minlength=count)
+
+        ended = ~np.isnan(self.total_times)
+        minutes = np.bincount(session_days[ended], weights=self.total_times[ended], minlength=count) / 60.0
+        shots = np.bincount(shot_days, minlength=count)
+        first = self.time_to_first_shot()
+        with_shots = ~np.isnan(first)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return {
+                'day': days,
+                'sessions': np.bincount(session_days, minlength=count),
+                'shots': shots,
+                'shot_mean_time': np.bincount(shot_days, weights=self.shot_durations, minlength=count) / shots,
+                'play_time': minutes * 60.0,
+                'calibration_rate': np.bincount(session_days[ended],
+                    weights=self.calibrations[ended], minlength=count) / minutes,
+                'lose_rate': np.bincount(session_days[ended],
+                    weights=self.loses[ended], minlength=count) / minutes,
+                'calibrations': total(self.calibrations).astype(int),
+                'loses': total(self.loses).astype(int),
+                'time_to_first_shot': np.bincount(session_days[with_shots],
+                    weights=first[with_shots], minlength=count)
+                    / np.bincount(session_days[with_shots], minlength=count),
+            }
+
+    def summary(self, percentiles=PERCENTILES):
+        """ overall figures over every session """
+        ended = ~np.isnan(self.total_times)
+        minutes = self.total_times[ended].sum() / 60.0
+        first = self.time_to_first_shot()
+
+        return {
+            'sessions': len(self),
+            'shots': len(self.shot_durations),
+            'shot_mean_time': self.shot_durations.mean() if len(self.shot_durations) else np.nan,
+            'shot_percentiles': self.duration_percentiles(percentiles),
+            'calibration_rate': self.calibrations[ended].sum() / minutes if minutes else np.nan,
+            'lose_rate': self.loses[ended].sum() / minutes if minutes else np.nan,
+            'time_to_first_shot': np.nanmean(first) if (~np.isnan(first)).any() else np.nan,
+        }
@@ -0,0 +1,232 @@
+""" Simulated cwiid backend
+
+SimulatedWiimote is a stand-in for cwiid.Wiimote's message-callback
+interface, fed by a synthetic stream of stick swings (swing_stream)
+so the capture.high_callback -> Tracker.receive path runs without
+a Bluetooth Wiimote
+
+On machines without cwiid, call install() before importing tracker,
+capture or gui: it registers a minimal cwiid module with the
+constants this project uses and SimulatedWiimote as cwiid.Wiimote
+"""
+import sys
+import types
+import random
+import threading
+import time as clock
+from math import cos, sin, acos
+
+""" cwiid constants (see cwiid.h) """
+try:
+    import cwiid
+except ImportError:
+    cwiid = types.ModuleType('cwiid')
+    cwiid.IR_X_MAX = 1024
+    cwiid.IR_Y_MAX = 768
+    (cwiid.MESG_STATUS, cwiid.MESG_BTN, cwiid.MESG_ACC, cwiid.MESG_IR,
+        cwiid.MESG_NUNCHUK, cwiid.MESG_CLASSIC, cwiid.MESG_BALANCE,
+        cwiid.MESG_MOTIONPLUS, cwiid.MESG_ERROR, cwiid.MESG_UNKNOWN) = range(10)
+    cwiid.FLAG_MESG_IFC = 0x01
+    cwiid.RPT_IR = 0x08
+    cwiid.LED3_ON = 0x04
+    cwiid.Wiimote = None # set below
+
+IR_SLOTS = 4
+
+""" (phase, duration in seconds) of a single swing """
+SWING_PHASES = (
+    ('calibration', 0.1),
+    ('approach', 0.4),
+    ('shot', 0.3),
+    ('rest', 0.4),
+)
+
+
+def install():
+    """ Registers cwiid (simulated if missing) in sys.modules """
+    if cwiid.Wiimote is None:
+        cwiid.Wiimote = SimulatedWiimote
+    sys.modules.setdefault('cwiid', cwiid)
+
+    return cwiid
+
+
+def swing_stream(swings=10, rate=100.0,
+    noise=1.0, dropout=0.0, spurious=0.0,
+    puck_height=cwiid.IR_Y_MAX*0.9, stick_height=150,
+    led_distances=(120, 300), camera_rotation=0,
+    phases=SWING_PHASES, seed=None):
+    """
+    Generates (time, sources) IR reports of a player performing swings
+
+    Each swing goes through phases (see SWING_PHASES):
+        - calibration: stick vertical and raised, trigger LED on
+        - approach: stick lowers until the blade touches the puck
+        - shot: stick rotates forward, blade crossing the shooting line
+        - rest: stick held after follow-through
+
+    rate: reports per second
+    noise: position noise standard deviation (pixels)
+    dropout: probability of each LED missing from a report
+    spurious: probability of a report carrying a random extra source
+    camera_rotation: raw coordinates are rotated so that a Tracker
+        configured with the same rotation sees the intended motion
+
+    sources follow cwiid's format: IR_SLOTS entries, None or {'pos', 'size'}
+    """
+    rnd = random.Random(seed)
+
+    top, bottom = led_distances
+    trigger = top - 100
+    pivot = (cwiid.IR_X_MAX//2, puck_height - bottom - stick_height)
+    lift = 150
+
+    origin = (cwiid.IR_X_MAX//2, cwiid.IR_Y_MAX//2)
+    a = -(camera_rotation%360) * acos(-1) / 180.0
+    ca, sa = cos(a), sin(a)
+
+    follow_through = 70 * acos(-1) / 180.0
+
+    def to_raw(x, y):
+        x, y = x - origin[0], y - origin[1]
+        return (origin[0] + ca * x - sa * y, origin[1] + ca * y + sa * x)
+
+    frame = 0
+    for _ in range(swings):
+        for (phase, duration) in phases:
+            steps = max(1, int(duration * rate))
+
+            for step in range(steps):
+                progress = step / float(steps)
+
+                if phase == 'calibration':
+                    angle, offset, leds = 0, lift, (trigger, top, bottom)
+                elif phase == 'approach':
+                    angle, offset, leds = 0, lift * (1 - progress), (top, bottom)
+                elif phase == 'shot':
+                    angle, offset, leds = follow_through * progress, 0, (top, bottom)
+                else:
+                    angle, offset, leds = follow_through, 0, (top, bottom)
+
+                points = []
+                for r in leds:
+                    if phase != 'calibration' and rnd.random() < dropout:
+                        continue
+                    points.append(to_raw(
+                        pivot[0] + r * sin(angle) + rnd.gauss(0, noise),
+                        pivot[1] - offset + r * cos(angle) + rnd.gauss(0, noise)))
+
+                if rnd.random() < spurious:
+                    points.append((rnd.uniform(0, cwiid.IR_X_MAX), rnd.uniform(0, cwiid.IR_Y_MAX)))
+
+                sources = [None] * IR_SLOTS
+                for (slot, p) in zip(rnd.sample(range(IR_SLOTS), IR_SLOTS), points[:IR_SLOTS]):
+                    if 0 <= p[0] < cwiid.IR_X_MAX and 0 <= p[1] < cwiid.IR_Y_MAX:
+                        sources[slot] = {'pos': (int(p[0]), int(p[1])), 'size': rnd.randint(1, 4)}
+
+                yield frame / float(rate), sources
+                frame += 1
+
+
+class SimulatedWiimote():
+    """
+    Stand-in for cwiid.Wiimote's message-callback interface
+
+    Once enabled with cwiid.FLAG_MESG_IFC, a background thread delivers
+    every report of stream to mesg_callback as [(cwiid.MESG_IR, sources)]
+    realtime paces reports by their timestamps, otherwise they are
+    delivered as fast as the callback consumes them
+    """
+    def __init__(self, stream=None, realtime=True):
+        self.stream = stream if stream is not None else swing_stream()
+        self.realtime = realtime
+
+        self.mesg_callback = None
+        self.rumble = 0
+        self.rpt_mode = 0
+        self.led = 0
+        self.flags = 0
+
+        self.start_time = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enable(self, flags):
+        self.flags |= flags
+
+        if self.flags & cwiid.FLAG_MESG_IFC and self._thread is None:
+            self._thread = threading.Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def disable(self, flags):
+        self.flags &= ~flags
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def join(self, timeout=None):
+        """ waits until the stream is exhausted (or the device closed) """
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        """
+        Delivers the whole stream in the calling thread
+        like cwiid, delivery starts once mesg_callback is set
+        """
+        while self.mesg_callback is None and not self._stop.is_set():
+            self._stop.wait(0.01)
+
+        self.start_time = clock.time()
+
+        for (time, sources) in self.stream:
+            if self._stop.is_set():
+                break
+
+            if self.realtime:
+                delay = time - (clock.time() - self.start_time)
+                if delay > 0:
+                    self._stop.wait(delay)
+
+            if self.mesg_callback is not None and self.flags & cwiid.FLAG_MESG_IFC:
+                self.mesg_callback([(cwiid.MESG_IR, sources)], self.start_time + time)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Runs a Tracker on a simulated Wiimote")
+    parser.add_argument('--swings', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=100.0)
+    parser.add_argument('--noise', type=float, default=1.0)
+    parser.add_argument('--dropout', type=float, default=0.0)
+    parser.add_argument('--spurious', type=float, default=0.0)
+    parser.add_argument('--camera-rotation', type=int, default=180)
+    parser.add_argument('--fast', action='store_true', help="do not pace reports in real time")
+    args = parser.parse_args()
+
+    install()
+    import logger as logging
+    import capture
+    from tracker import Tracker
+
+    tracker = Tracker(cwiid.IR_Y_MAX*0.9, puck_proximity=25, stick_height=150,
+        camera_rotation=args.camera_rotation, log_level=logging.WARNING)
+
+    wiimote = capture.get_wiimote(lambda: SimulatedWiimote(swing_stream(
+        swings=args.swings, rate=args.rate,
+        noise=args.noise, dropout=args.dropout, spurious=args.spurious,
+        camera_rotation=args.camera_rotation), realtime=not args.fast))
+    wiimote.mesg_callback = capture.high_callback(lambda mesg, time: tracker.receive(mesg[1], time))
+
+    ''' capture only flags device errors, the device is closed from here '''
+    while wiimote._thread.is_alive() and not capture.wiimote_failed.is_set():
+        wiimote.join(0.1)
+    wiimote.close()
+
+    sys.stdout.write("%d shots detected out of %d swings\n" % (tracker.shoot_counter, args.swings))
+
+main() if __name__ == '__main__' else True
@@ -0,0 +1,116 @@
+""" Persistent per-session stats cache for log_parser
+
+Session logs never change once a play ends, so their file_stats and
+meta_stats results are kept on disk keyed by (path, size, mtime), size
+and mtime covering every segment of rotated logs
+and only new or modified logs are parsed again
+
+The cache is a JSON file rewritten atomically on save, only when
+sessions were added or evicted; when it holds more than max_sessions
+sessions the least recently used ones are evicted (the bound is a
+session count, not a file size)
+"""
+import os
+import json
+
+from log_writer import segments_signature
+
+DEFAULT_MAX_SESSIONS = 100000
+
+
+def native_keys(d):
+    """ json gives unicode keys on Python 2, stats use native strings """
+    return dict((k if isinstance(k, str) else k.encode('utf-8'), v) for (k, v) in d.items())
+
+
+class StatsCache():
+    def __init__(self, path, max_sessions=DEFAULT_MAX_SESSIONS):
+        self.path = path
+        self.max_sessions = max_sessions
+
+        self.entries = {}
+        self.clock = 0 # last use order, for eviction
+        self.dirty = False
+
+        self.hits = 0
+        self.misses = 0
+
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path) as f:
+                data = json.load(f, object_hook=native_keys)
+        except ValueError:
+            """ corrupted cache, starts over """
+            return
+
+        self.entries = data.get('entries', {})
+        self.clock = data.get('clock', 0)
+
+    def save(self):
+        self.evict()
+
+        if not self.dirty:
+            return
+
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'clock': self.clock, 'entries': self.entries}, f)
+        os.rename(temporary, self.path)
+
+        self.dirty = False
+
+    def clear(self):
+        self.entries = {}
+        self.clock = 0
+        self.dirty = True
+
+    def get(self, path):
+        """ (stats, meta) of path if cached and unchanged, otherwise None """
+        key, size, mtime = self._signature(path)
+        entry = self.entries.get(key)
+
+        if entry is None or entry['size'] != size or entry['mtime'] != mtime:
+            self.misses += 1
+            return None
+
+        ''' a hit alone does not rewrite the file, use stamps are saved with the next change '''
+        self.hits += 1
+        self.clock += 1
+        entry['used'] = self.clock
+
+        return entry['stats'], entry['meta']
+
+    def put(self, path, stats, meta):
+        key, size, mtime = self._signature(path)
+
+        self.clock += 1
+        self.entries[key] = {
+            'size': size,
+            'mtime': mtime,
+            'stats': stats,
+            'meta': meta,
+            'used': self.clock,
+        }
+        self.dirty = True
+
+    def evict(self):
+        excess = len(self.entries) - self.max_sessions
+        if excess <= 0:
+            return
+
+        oldest = sorted(self.entries, key=lambda k: self.entries[k]['used'])[:excess]
+        for key in oldest:
+            del self.entries[key]
+
+        self.dirty = True
+
+    """ Internal Methods """
+    def _signature(self, path):
+        ''' over every segment of rotated logs, see log_writer.segments_signature '''
+        size, mtime = segments_signature(path)
+        return os.path.abspath(path), size, mtime
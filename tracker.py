@@ -1,94 +1,148 @@
 from math import cos, sin, acos
+from itertools import chain
+import time as clock
 
-import copy
-from datetime import datetime
+import numpy as np
 
 import cwiid
 
-class bcolors:
-    HEADER = '\033[95m'
-    OKBLUE = '\033[94m'
-    OKGREEN = '\033[92m'
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
-
-    def __init__(self):
-        self.logfile = None
-        self.logtimestamp = None
-
-    def disable(self):
-        self.HEADER = ''
-        self.OKBLUE = ''
-        self.OKGREEN = ''
-        self.WARNING = ''
-        self.FAIL = ''
-        self.ENDC = ''
-
-    def disk(self, message, end_line=True):
-        if self.logfile is not None:
-            self.logfile.write(str(message))
-
-            if end_line:
-                delta = datetime.now() - self.logtimestamp
-                self.logfile.write(" [%s]" % (delta.total_seconds()))
-                self.logfile.write('\n')
-
-    def _color_message(self, color, message, end_line=True, skip_disk=False):
-        if not skip_disk:
-            self.disk(message)
-
-        if end_line:
-            print color + str(message) + self.ENDC
-        else:
-            print color + str(message),
+import logger as logging
+import session_log
+from matching import GreedyMatcher
+
+''' clock for reports without a device timestamp: monotonic where
+  available (Python 3), wall-clock time.time on Python 2, which jumps
+  with system clock changes '''
+fallback_clock = getattr(clock, 'monotonic', clock.time)
+
+''' receive_batch frames converted to Python lists at once '''
+BATCH_BLOCK = 256
+
+class IRSource(object):
+    """
+    Compact representation of a detected IR source
+    pos is an (x, y) tuple in tracker coordinates
+    """
+    __slots__ = ('pos', 'size')
+
+    def __init__(self, pos, size):
+        self.pos = pos
+        self.size = size
+
+    def __repr__(self):
+        return "{'pos': %s, 'size': %s}" % (str(self.pos), str(self.size))
+
+
+class Snapshot(object):
+    """
+    Fixed-size tracked state, preallocated once and updated in place
+    The k-th point is the k-th tracked source (see Tracker.state_dict)
+    """
+    __slots__ = ('points', 'valid')
+
+    def __init__(self, size):
+        self.points = [IRSource(None, None) for _ in range(size)]
+        self.valid = False
+
+    def __getitem__(self, k):
+        return self.points[k]
+
+    def __len__(self):
+        return len(self.points)
+
+    def __iter__(self):
+        return iter(self.points)
+
+    def keys(self):
+        return range(len(self.points))
+
+    def items(self):
+        return enumerate(self.points)
 
-    def warning(self, message, **kwargs):
-        self._color_message(self.WARNING, message, skip_disk=True, **kwargs)
+    def __repr__(self):
+        return '{%s}' % ', '.join('%d: %s' % (k, v) for (k, v) in self.items())
 
-    def error(self, message, **kwargs):
-        self._color_message(self.FAIL, message, **kwargs)
+    def _assign(self, sources, indexes=None):
+        """ copies sources (or sources[indexes[k]]) into the k-th point """
+        for (k, point) in enumerate(self.points):
+            source = sources[k if indexes is None else indexes[k]]
+            point.pos = source.pos
+            point.size = source.size
 
-    def green(self, message, **kwargs):
-        self._color_message(self.OKGREEN, message, **kwargs)
+        self.valid = True
 
-    def blue(self, message, **kwargs):
-        self._color_message(self.OKBLUE, message, skip_disk=True, **kwargs)
+    def _clear(self):
+        self.valid = False
 
 
+class TrackerFrame(object):
+    """
+    Immutable view of the tracker after a report, published for readers
+    on other threads (see Tracker.frame)
+        sources: tuple of the IRSource detected in the report
+        snapshot: tuple of tracked (x, y) positions, None while uncalibrated
+        touching_point: (x, y) or None
+    """
+    __slots__ = ('state', 'sources', 'snapshot', 'touching_point', 'shoot_counter', 'time')
+
+    def __init__(self, state, sources, snapshot, touching_point, shoot_counter, time):
+        self.state = state
+        self.sources = sources
+        self.snapshot = snapshot
+        self.touching_point = touching_point
+        self.shoot_counter = shoot_counter
+        self.time = time
+
 
 class Tracker():
     def __init__(self,
         puck_height, puck_proximity=10,
         stick_height=50,
         camera_rotation=0,
+        tracker_size=2,
+        matcher=None,
         verbose=True, debug=False,
-        calibration_patience=int(1e3),
-        tracking_patience=int(1e2)
+        log_level=logging.INFO,
+        calibration_patience=10.0,
+        tracking_patience=1.0,
+        publish_frames=False
         ):
-        self.logger = bcolors()
+        """
+        calibration_patience: seconds between "waiting for calibration" warnings
+        tracking_patience: seconds without tracking before losing track
+
+        Timing comes from the report timestamps given to receive (the
+        device's), so replayed sessions time out and log like live ones
+
+        publish_frames: publishes a TrackerFrame after every report, so
+            other threads (e.g. a GUI) never read state mid-update
+        """
+        self.logger = logging.Logger(log_level)
 
 
         """ instantiate state represetation as invalid """
         self.state = 'U'
         self.current_sources = []
-        self.calibration_snapshot = None
-        self.current_snapshot = None
-
-        self.touching_point = None
+        self.session = None
 
         self.last_tracking_status = 'NACK'
+        self.last_match_cost = None
 
         """ config """
-        self.tracker_size = 2
+        self.tracker_size = tracker_size
         self.trigger_index = 0
+        self.stick_keys = (0, 1)
 
-        self.puck_position = tuple(map(int, (cwiid.IR_X_MAX*0.5, puck_height)))
-        self.shooting_line = self.puck_position[1] - cwiid.IR_Y_MAX*0.1
+        self.matcher = matcher if matcher is not None else GreedyMatcher()
+
+        self._place_puck(puck_height)
         self.puck_proximity = puck_proximity
         self.stick_height = stick_height
+        self.horizontal_proximity = int(1e2)
 
         self.camera_rotation = camera_rotation
+        self._rotation_origin = (cwiid.IR_X_MAX//2, cwiid.IR_Y_MAX//2)
+        self._rotation = self.rotation_transform(camera_rotation)
 
         self.verbose = verbose
         self.debugging = debug
@@ -96,12 +150,25 @@ class Tracker():
         self.calibration_patience = calibration_patience
         self.tracking_patience = tracking_patience
 
-        """  """
-        self.ask_counter = 0
+        """ report timestamps """
+        self._time = None
+        self._session_start = None
+        self._asked_at = None
+        self._lost_since = None
         self.lose_counter = 0
 
+        """ preallocated tracking state, updated in place """
+        self._calibration = Snapshot(self.tracker_size)
+        self._current = Snapshot(self.tracker_size)
+
+        self._touching_point = [0, 0]
+        self._touching_valid = False
+
         self.shoot_counter = 0
 
+        self.publish_frames = publish_frames
+        self.frame = TrackerFrame(self.state, (), None, None, 0, None)
+
     """ Actions """
     def _calibrate(self, sources):
         """ Assumptions:
@@ -113,15 +180,18 @@ class Tracker():
         self.state = 'W'
         self.lose_counter = 0
 
-        self.calibration_snapshot = self.state_dict(sources)
-        self.current_snapshot = copy.deepcopy(self.calibration_snapshot)
+        ordered = self.state_dict(sources)
+        self._calibration._assign(ordered)
+        self._current._assign(ordered)
 
     def _start_shoot(self):
-        self.logger.green("Shoot started")
+        self.logger.info("Shoot started")
+        self._record(session_log.SHOT_START)
         self.state = 'S'
 
     def _end_shoot(self):
-        self.logger.green("Shoot ended")
+        self.logger.info("Shoot ended")
+        self._record(session_log.SHOT_END)
         self.shoot_counter += 1
 
         #self.state = 'W'
@@ -129,112 +199,219 @@ class Tracker():
         ''' uncalibrating so user controls shooting start better
           resets
         '''
-        self.state = 'U'
-
-        self.calibration_snapshot = None
-        self.current_snapshot = None
-        self.touching_point = None
-
-        self.ask_counter = 0
+        self._uncalibrate()
 
     def _lose_track(self):
         if self.verbose:
             self.logger.error("Lost track!")
+        self._record(session_log.LOST_TRACK)
 
+        self._uncalibrate()
+
+    def _uncalibrate(self):
         self.state = 'U'
+        self._clear_tracking()
 
-        self.calibration_snapshot = None
-        self.current_snapshot = None
-        self.touching_point = None
+        self._asked_at = None
 
-        self.ask_counter = 0
+    def _clear_tracking(self):
+        self._calibration._clear()
+        self._current._clear()
+        self._touching_valid = False
 
     def _track_sources(self, sources):
         """ Assumptions:
         - instance is calibrated
         - sources is a valid snapshot
 
-        Returns a current_snapshot update
+        Returns the source index matched to each current_snapshot point
+        (None if any point could not be matched)
         """
 
         if self.debugging:
             assert self.current_snapshot is not None
             assert len(sources) == self.tracker_size
 
-        tracked = {}
-        added_keys = []
-
-        for k, v in self.current_snapshot.items():
-            print(sources)
-            print(v)
-            """ builds a list of (point_id, distance) so
-            we can compute the match source to its closest point """
-            t = list(map(
-                lambda (i,s): (i,
-                    (s['pos'][0]-v['pos'][0])**2 +
-                    (s['pos'][1]-v['pos'][1])**2),
-                enumerate(sources)
-            ))
-
-            t = sorted(t, key = lambda x: x[1])
-
-            best = t[0][0] # sources index
-
-            if best in added_keys:
-                """ stalemate: detected source is equidistant to multiple tracked ones """
-                self.logger.warning("stalemate")
-                pass
-            else:
-                self.logger.blue("Matching point %d-th point %s to %s" % (k, str(v), str(sources[best])))
-                tracked[k] = sources[best]
-                added_keys.append(best)
+        self.logger.debug("Sources: %s", sources)
+        assignment, cost = self.matcher.match(
+            [v.pos for v in self._current],
+            [s.pos for s in sources]
+        )
+        self.last_match_cost = cost
+
+        tracked = 0
+        for (k, best) in enumerate(assignment):
+            if best is not None:
+                self.logger.debug("Matching point %d-th point %s to %s", k, self._current[k], sources[best])
+                tracked += 1
 
         if self.debugging:
             """ the logic should never allow the assert below to fail """
             try:
-                assert len(tracked) == self.tracker_size
+                assert tracked == self.tracker_size
             except:
-                print "Sources: ", sources
-                self.logger.warning("Failed trying to match %d-th point (%s) to %s but \
-                    its value is %s" % (i, str(s), best, tracked[best]))
+                self.logger.warning("Failed trying to match %s to %s (cost %s)",
+                    self._current, sources, cost)
                 exit()
 
-        print(self.logger.blue("Tracking %d points!!" % len(tracked.keys())))
+        self.logger.debug("Tracking %d points!! (cost %d)", tracked, cost)
 
-        if (len(tracked.keys()) < self.tracker_size):
+        if (tracked < self.tracker_size):
             return None
         else:
-            return tracked
+            return assignment
 
 
     """ Interface """
-    def receive(self, sources, time):
+    def receive(self, sources, time=None):
         """
+        time: report timestamp in seconds (cwiid's), fallback_clock when None
         """
+        if time is None:
+            time = fallback_clock()
+
         sources = self.sources_preprocess(sources)
-        self.current_sources = sources
 
         valid = self.is_valid_snapshot(sources)
-        could_track = False
+        calibration_moment = self.is_calibration_snapshot(sources) if valid else False
 
+        self._step(sources, time, valid, calibration_moment)
 
-        calibration_moment = self.is_calibration_snapshot(sources) if valid else False
+    def receive_batch(self, times, sources):
+        """
+        Offline counterpart of receive for a whole recorded session
+
+        times: (N,) array of message timestamps
+        sources: (N, 4, 3) masked array of (x, y, size) per IR slot,
+            missing slots are masked
+
+        Preprocessing, validity and calibration checks run over the
+        whole array at once; the state machine then steps through
+        the frames in order, so results match N calls to receive
+        (see benchmark.py --check-batch). Uncalibrated stretches are
+        skipped up to their next calibration frame, matching stays
+        sequential
+
+        Returns (states, touching_points, shots)
+            states: (N,) array of the state after each frame
+            touching_points: (N, 2) masked array, masked while undefined
+            shots: list of (frame_index, 'start' | 'end')
+        """
+        sources = np.ma.asarray(sources)
+        frames = len(sources)
+
+        present = ~np.ma.getmaskarray(sources).any(axis=-1)
+        data = np.ma.getdata(sources).astype(int)
+
+        pos = self.rotate_array(data[..., :2])
+        size = data[..., 2]
+
+        """ validity """
+        counts = present.sum(axis=1)
+        valid = counts >= self.tracker_size
+
+        """ calibration """
+        xs = np.where(present, pos[..., 0], 0)
+        horizontal_mean = xs.sum(axis=1) / np.maximum(counts, 1).astype(float)
+        horizontal_diffs = (pos[..., 0] - horizontal_mean[:, None]) ** 2
+        near_axis = np.where(present,
+            horizontal_diffs <= self.horizontal_proximity**2, True).all(axis=1)
+        calibration = valid & (counts == 1 + self.tracker_size) & near_axis
+
+        """ state machine """
+        states = ['U'] * frames
+        touching_points = [None] * frames
+        shots = []
+
+        calibration_frames = np.flatnonzero(calibration)
+        times, valid, calibration = np.asarray(times).tolist(), valid.tolist(), calibration.tolist()
+
+        """ (x, y, size, present) rows, converted a block at a time as frames are stepped """
+        slots = np.concatenate((pos, size[..., None], present[..., None]), axis=-1)
+        block, block_start = [], 0
+
+        i, skipped = 0, False
+        while i < frames:
+            state = self.state
+
+            if state == 'U' and not calibration[i] and not self.publish_frames:
+                """
+                waiting for calibration until the next calibration frame:
+                the whole run is skipped, its sources are never looked at
+                """
+                run_end = calibration_frames[np.searchsorted(calibration_frames, i)] \
+                    if calibration_frames.size and calibration_frames[-1] > i else frames
+
+                self._tick(times[i])
+                self._time = times[run_end - 1]
+                self._wait(times[i:run_end])
+                self.last_tracking_status = False
+
+                i, skipped = run_end, True
+                continue
+
+            skipped = False
+            shoot_counter = self.shoot_counter
+
+            if i - block_start >= len(block):
+                block, block_start = slots[i:i + BATCH_BLOCK].tolist(), i
+
+            self._step([IRSource((x, y), z) for (x, y, z, p) in block[i - block_start] if p],
+                times[i], valid[i], calibration[i])
+
+            if self.state != state:
+                states[i] = self.state
+                if self.shoot_counter > shoot_counter:
+                    shots.append((i, 'end'))
+                elif self.state == 'S':
+                    shots.append((i, 'start'))
+            else:
+                states[i] = state
+
+            if self._touching_valid:
+                touching_points[i] = tuple(self._touching_point)
+
+            i += 1
+
+        if skipped:
+            self.current_sources = [IRSource((x, y), z) for (x, y, z, p) in slots[-1].tolist() if p]
+
+        touching = np.fromiter((point is not None for point in touching_points),
+            dtype=bool, count=frames)
+        touching_points = np.ma.array(
+            np.fromiter(chain.from_iterable(point or (0, 0) for point in touching_points),
+                dtype=int, count=2*frames).reshape(frames, 2),
+            mask=np.repeat(~touching[:, None], 2, axis=1))
+
+        return np.array(states), touching_points, shots
+
+    """ Internal Methods """
+    def _step(self, sources, time, valid, calibration_moment):
+        """ Assumptions:
+        - sources is preprocessed
+        - valid and calibration_moment were computed for sources
+
+        Single state machine transition shared by receive and receive_batch
+        """
+        self.current_sources = sources
+        could_track = False
+
+        self._tick(time)
 
         if calibration_moment:
             """ excludes trigger """
-            sources.sort(key=lambda x: x['pos'][1])
-            print("EXCLUDING TRIGGER SOURCES", sources)
+            sources.sort(key=lambda x: x.pos[1])
+            self.logger.debug("Excluding trigger sources %s", sources)
             sources = sources[:self.trigger_index] + sources[1+self.trigger_index:]
 
         if self.state == 'U':
             if calibration_moment and valid:
-                self.logger.green("Calibrating")
+                self.logger.info("Calibrating")
+                self._record(session_log.CALIBRATION)
                 self._calibrate(sources)
 
             else:
-                if self.ask_counter == 0:
-                    self.logger.warning("Waiting for calibration trigger")
-                self.ask_counter = (self.ask_counter + 1) % self.calibration_patience
+                self._wait((time,))
 
         else:
             if valid:
@@ -244,7 +421,7 @@ class Tracker():
 
             if could_track:
                 self.lose_counter = 0
-                self.current_snapshot = tracking_results
+                self._current._assign(sources, tracking_results)
 
                 #sources = [v for (k,v) in self.current_snapshot.items()]
 
@@ -269,18 +446,22 @@ class Tracker():
             else:
                 """ tracking patience """
                 self.lose_counter += 1
+                if self.lose_counter == 1:
+                    self._lost_since = time
 
-                self.logger.warning("%s : %s" % (self.lose_counter, str(sources)))
+                self.logger.debug("%s : %s", self.lose_counter, sources)
 
-                if self.lose_counter >= self.tracking_patience:
+                if time - self._lost_since >= self.tracking_patience:
                     if self.state == 'S':
                         self._end_shoot()
                     self._lose_track()
-                    self.current_snapshot = None
 
 
         self.last_tracking_status = could_track
 
+        if self.publish_frames:
+            self._publish(time)
+
         """ stdout logging """
         if self.verbose:
 
@@ -288,40 +469,141 @@ class Tracker():
                 self.log(sources, time)
 
             if self.current_snapshot:
-                print "current_snapshot [%s]: %s" % (self.state, self.current_snapshot)
+                self.logger.debug("current_snapshot [%s]: %s", self.state, self.current_snapshot)
+
+    def _tick(self, time):
+        self._time = time
+        if self._session_start is None:
+            self._session_start = time
+
+    def _wait(self, times):
+        """
+        Asks for the calibration trigger, once per calibration_patience,
+        over consecutive uncalibrated report times
+        """
+        asked_at, patience = self._asked_at, self.calibration_patience
+
+        for time in times:
+            if asked_at is None or time - asked_at >= patience:
+                self.logger.warning("Waiting for calibration trigger")
+                asked_at = time
+
+        self._asked_at = asked_at
+
+    @property
+    def calibration_snapshot(self):
+        """ read-only view of the calibration snapshot, None while uncalibrated """
+        return self._calibration if self._calibration.valid else None
+
+    @property
+    def current_snapshot(self):
+        """ read-only view of the tracked snapshot, None while uncalibrated """
+        return self._current if self._current.valid else None
+
+    @property
+    def touching_point(self):
+        return tuple(self._touching_point) if self._touching_valid else None
 
     def reset_shoot_counter(self):
         self.shoot_counter = 0
 
+    def reconfigure(self, puck_height=None, puck_proximity=None, stick_height=None, camera_rotation=None):
+        """
+        Applies configuration changes in place (None keeps the current value)
+        Derived values (puck position, shooting line, rotation transform)
+        are recomputed once per change; calibration and counters are kept,
+        except on a rotation change since calibrated positions are rotated:
+        the tracker is uncalibrated and a shot in progress is dropped,
+        neither counted nor recorded
+
+        Not synchronized with receive: call it between reports, e.g.
+        holding the lock the report callback holds (see gui.py)
+        """
+        if puck_height is not None:
+            self._place_puck(puck_height)
+
+        if puck_proximity is not None:
+            self.puck_proximity = puck_proximity
+
+        if stick_height is not None:
+            self.stick_height = stick_height
+
+        if camera_rotation is not None and camera_rotation != self.camera_rotation:
+            self.camera_rotation = camera_rotation
+            self._rotation = self.rotation_transform(camera_rotation)
+
+            if self.state == 'S':
+                self.logger.info("Shoot cancelled, camera rotation changed")
+            self._uncalibrate()
+
     def set_logging_point(self, logging_point):
-        self.logger.logfile = logging_point
-        self.logger.logtimestamp = datetime.now()
+        """
+        logging_point: a session log (see session_log),
+            a plain file is wrapped as a text session log,
+            None stops logging
+        """
+        if logging_point is not None and not hasattr(logging_point, 'event'):
+            logging_point = session_log.TextSessionLog(logging_point)
 
-    """ Internal Methods """
+        self.session = logging_point
+        self._session_start = None
 
+    def session_time(self):
+        """ seconds from the first report of the session to the latest one """
+        if self._session_start is None:
+            return 0.0
+        return self._time - self._session_start
 
     def sources_preprocess(self, sources):
         """
         Filter and map functions for raw sources
         """
-        sources = list(filter(lambda x: x is not None, sources))
+        if self._rotation is None:
+            return [IRSource(x['pos'], x['size']) for x in sources if x is not None]
+
+        c, s = self._rotation
+        ox, oy = self._rotation_origin
+
+        return [
+            IRSource((
+                int(ox + c * (x['pos'][0]-ox) - s * (x['pos'][1]-oy)),
+                int(oy + c * (x['pos'][1]-oy) + s * (x['pos'][0]-ox)),
+            ), x['size'])
+            for x in sources if x is not None
+        ]
 
-        def rotate_point(p,a,o):
-            p = (p[0]-o[0], p[1]-o[1])
-            a = (a%360) * acos(-1) / 180.0
-            return (
-                int(o[0] + cos(a) * p[0] - sin(a) * p[1]),
-                int(o[1] + cos(a) * p[1] + sin(a) * p[0]),
-            )
+    def _place_puck(self, puck_height):
+        self.puck_position = tuple(map(int, (cwiid.IR_X_MAX*0.5, puck_height)))
+        self.shooting_line = self.puck_position[1] - cwiid.IR_Y_MAX*0.1
+
+    def rotation_transform(self, camera_rotation):
+        """
+        (cos, sin) of camera_rotation, computed once per configuration
+        None stands for the identity (0 degrees), which skips rotating
+        """
+        if camera_rotation % 360 == 0:
+            return None
+
+        a = (camera_rotation%360) * acos(-1) / 180.0
+        return (cos(a), sin(a))
 
-        sources = list(map(lambda x: {
-            'pos': rotate_point(x['pos'],
-                    self.camera_rotation, (cwiid.IR_X_MAX//2, cwiid.IR_Y_MAX//2)
-                    ),
-            'size': x['size']
-        }, sources))
+    def rotate_array(self, positions):
+        """
+        Array counterpart of the rotation in sources_preprocess
+        positions: (..., 2) integer array of raw IR coordinates
+        """
+        if self._rotation is None:
+            return positions
 
-        return sources
+        c, s = self._rotation
+        o = self._rotation_origin
+
+        p = (positions[..., 0] - o[0], positions[..., 1] - o[1])
+
+        return np.stack((
+            o[0] + c * p[0] - s * p[1],
+            o[1] + c * p[1] + s * p[0],
+        ), axis=-1).astype(int)
 
     def update_touching_point(self):
         def next_point(p0, p1, s):
@@ -341,7 +623,10 @@ class Tracker():
                 p1[1] + d[1]
             )))
 
-        self.touching_point = next_point(self.current_snapshot[0]['pos'], self.current_snapshot[1]['pos'], self.stick_height)
+        top, bottom = self.stick_keys
+        self._touching_point[0], self._touching_point[1] = next_point(
+            self._current[top].pos, self._current[bottom].pos, self.stick_height)
+        self._touching_valid = True
 
     def is_valid_snapshot(self, sources):
         """
@@ -355,25 +640,24 @@ class Tracker():
     def is_calibration_snapshot(self, sources):
         """
         """
-        horizontal_proximity = int(1e2)
+        horizontal_proximity = self.horizontal_proximity
         trigger_index = 1 + self.tracker_size//2
 
         if len(sources) == (1 + self.tracker_size):
-            horizontal_mean = sum(map(lambda x: x['pos'][0], sources)) / float(len(sources))
-            horizontal_diffs = list(map(lambda x: (x['pos'][0] - horizontal_mean)**2, sources))
+            horizontal_mean = sum(map(lambda x: x.pos[0], sources)) / float(len(sources))
+            horizontal_diffs = list(map(lambda x: (x.pos[0] - horizontal_mean)**2, sources))
 
-            # debug print
-            for i in range(len(sources)):
-                print(sources[i], horizontal_mean, horizontal_diffs[i])
+            self.logger.debug("Calibration check %s mean %s diffs %s",
+                sources, horizontal_mean, horizontal_diffs)
 
             if all(map(lambda x: x <= horizontal_proximity**2, horizontal_diffs)):
                 return True
 
             else:
-                self.logger.warning("At least one detected point is too far from axis")
+                self.logger.debug("At least one detected point is too far from axis")
         else:
             if len(sources) != self.tracker_size:
-                self.logger.warning("Too much (%d) sources detected" % (len(sources)))
+                self.logger.debug("Too much (%d) sources detected", len(sources))
 
         return False
 
@@ -384,10 +668,12 @@ class Tracker():
         Tells if lowest stick point is touching virtual puck location
         """
 
+        touching_point = self._touching_point
+
         condition = (
-            (self.touching_point[0] - self.puck_position[0])**2 +
-            (self.touching_point[1] - self.puck_position[1])**2
-        ) <= self.puck_proximity**2 if self.touching_point else False
+            (touching_point[0] - self.puck_position[0])**2 +
+            (touching_point[1] - self.puck_position[1])**2
+        ) <= self.puck_proximity**2 if self._touching_valid else False
 
         return condition
 
@@ -399,7 +685,7 @@ class Tracker():
         Tells if shoot is still being performed
         """
 
-        condition = self.touching_point[1] > self.shooting_line if self.touching_point else False
+        condition = self._touching_point[1] > self.shooting_line if self._touching_valid else False
 
         return condition
 
@@ -408,9 +694,9 @@ class Tracker():
         - sources is a valid snapshot
 
         Behavior:
-            Builds a dictionary so any tracked point is identified
-            Tracking process is essentially updating this dictionary
-                in a way any value comes from detected sources
+            Orders sources so any tracked point is identified by its index
+            Tracking process is essentially updating the snapshot
+                at these indexes in a way any value comes from detected sources
 
         [ DEVELOPMENT
         This is the point for dealing with
@@ -435,37 +721,49 @@ class Tracker():
 
         ]
         """
-        return { i:v for (i,v) in enumerate(sorted(sources, key=lambda x: x['pos'][1])) }
+        return sorted(sources, key=lambda x: x.pos[1])
 
     """ I/O """
+    def _publish(self, time):
+        """
+        Swaps in a new TrackerFrame, a single reference assignment:
+        readers get either the previous frame or this one, never a mix
+        """
+        self.frame = TrackerFrame(
+            self.state,
+            tuple(self.current_sources),
+            tuple(point.pos for point in self._current) if self._current.valid else None,
+            self.touching_point,
+            self.shoot_counter,
+            time)
+
+    def _record(self, event):
+        if self.session is not None:
+            self.session.event(event, self.session_time())
+
     def log(self, sources, time):
         """ STDOUT """
-        valid_src = False
-        self.logger.blue(self.state + ' ', end_line=False)
-        for src in sources:
-            if src:
-                valid_src = True
-                self.logger.blue(str(src['pos']), end_line=False)
-
-                self.logger.blue(' ' + str(src['size']), end_line=False)
-
-        if valid_src:
-            print '' + bcolors.ENDC
+        if sources and self.logger.is_enabled(logging.DEBUG):
+            self.logger.debug("%s %s", self.state, ' '.join(
+                "%s %s" % (str(src.pos), str(src.size)) for src in sources))
 
         """ DISK """
         self.disk_state_dump() # ends line
 
     def disk_state_dump(self):
         """
-        Renders current_snapshot (if any) as a 3D line in a text file
+        Renders current_snapshot (if any) as a 3D line in the session log,
+        along with the touching point
         """
-        if self.current_snapshot is not None:
+        if self.session is not None and self._current.valid:
             # ESTIMATE Z-COORDINATE
-            calibration_distance = (self.calibration_snapshot[0]['pos'][0] - self.calibration_snapshot[1]['pos'][0]) ** 2
-            calibration_distance+= (self.calibration_snapshot[0]['pos'][1] - self.calibration_snapshot[1]['pos'][1]) ** 2
+            calibration, current = self._calibration, self._current
+
+            calibration_distance = (calibration[0].pos[0] - calibration[1].pos[0]) ** 2
+            calibration_distance+= (calibration[0].pos[1] - calibration[1].pos[1]) ** 2
 
-            current_distance = (self.current_snapshot[0]['pos'][0] - self.current_snapshot[1]['pos'][0]) ** 2
-            current_distance+= (self.current_snapshot[0]['pos'][1] - self.current_snapshot[1]['pos'][1]) ** 2
+            current_distance = (current[0].pos[0] - current[1].pos[0]) ** 2
+            current_distance+= (current[0].pos[1] - current[1].pos[1]) ** 2
 
             z_estim = max(0, (calibration_distance - current_distance)) ** (0.5)
 
@@ -474,8 +772,6 @@ class Tracker():
             print("Z distances %f %f %f" % (calibration_distance, current_distance, z_estim))
             '''
 
-            dump = list(map(lambda (k,x): list(x['pos']) + [0 if k==0 else z_estim], self.current_snapshot.items()))
-
-            dump_str = ''.join(map(lambda x: "%d %d %d " % (x[0], x[1], x[2]), dump))
+            dump = list(map(lambda (k,x): list(x.pos) + [0 if k==0 else z_estim], current.items()))
 
-            self.logger.disk(dump_str)
+            self.session.frame(self.state, dump, self.session_time(), touching=self.touching_point)
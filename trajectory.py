@@ -0,0 +1,217 @@
+""" Columnar trajectory export
+
+Stores the stick trajectory of a play as one NumPy array per column,
+ready for vectorized analysis without parsing logs again
+
+    time       : f8 (N,)       seconds since session start
+    state      : S1 (N,)       tracker state of each frame
+    leds       : i2 (N, 2, 3)  (x, y, z) of each tracked LED
+    touching   : f4 (N, 2)     stick touching point, NaN when unknown
+    event_type : u1 (M,)       non-frame records (see session_log types)
+    event_time : f8 (M,)
+    kind       : u1 ()         session kind
+
+Two layouts:
+    'npy': a <name>.traj directory with one .npy file per column, each
+        memory-mappable (load_trajectory, or np.load(..., mmap_mode='r'))
+    'npz': a single <name>.npz archive, easier to move around but
+        loaded in memory
+
+TrajectoryLog records live from a Tracker (it is a session log sink),
+convert exports existing .test / .hsl session logs
+
+    python trajectory.py output/*.test [--format npz] [--stick-height 150]
+"""
+import os
+import sys
+import argparse
+import time as clock
+
+import numpy as np
+
+import session_log
+
+TRACKED_POINTS = session_log.TRACKED_POINTS
+
+FRAME_DTYPE = np.dtype([
+    ('time', '<f8'),
+    ('state', 'S1'),
+    ('leds', '<i2', (TRACKED_POINTS, 3)),
+    ('touching', '<f4', (2,)),
+])
+
+EVENT_DTYPE = np.dtype([
+    ('type', 'u1'),
+    ('time', '<f8'),
+])
+
+FORMATS = ('npy', 'npz')
+EXTENSIONS = {'npy': '.traj', 'npz': '.npz'}
+
+CHUNK_FRAMES = 4096
+
+
+class TrajectoryLog():
+    """
+    Session log sink gathering frames into fixed-size record chunks,
+    columns are written on close (path without extension)
+    """
+    def __init__(self, path, kind=session_log.UNKNOWN_SESSION, fmt='npy', chunk_frames=CHUNK_FRAMES):
+        if fmt not in FORMATS:
+            raise ValueError("Unknown trajectory format %s" % fmt)
+
+        self.path = path + EXTENSIONS[fmt]
+        self.kind = kind
+        self.fmt = fmt
+        self.start = clock.time()
+
+        self.chunk_frames = chunk_frames
+        self.chunks = []
+        self.chunk = np.zeros(chunk_frames, dtype=FRAME_DTYPE)
+        self.frames = 0 # in current chunk
+        self.events = []
+
+        self.closed = False
+
+    def elapsed(self):
+        return clock.time() - self.start
+
+    def event(self, kind, time=None):
+        self.events.append((kind, time if time is not None else self.elapsed()))
+
+    def frame(self, state, points, time=None, touching=None):
+        if self.frames == self.chunk_frames:
+            self.chunks.append(self.chunk)
+            self.chunk = np.zeros(self.chunk_frames, dtype=FRAME_DTYPE)
+            self.frames = 0
+
+        record = self.chunk[self.frames]
+        record['time'] = time if time is not None else self.elapsed()
+        record['state'] = state
+        for (k, p) in enumerate(points[:TRACKED_POINTS]):
+            record['leds'][k] = p
+        record['touching'] = touching if touching is not None else np.nan
+
+        self.frames += 1
+
+    def end(self, time=None):
+        self.event(session_log.SESSION_END, time)
+
+    def close(self):
+        if self.closed:
+            return
+
+        frames = np.concatenate(self.chunks + [self.chunk[:self.frames]])
+        events = np.array(self.events, dtype=EVENT_DTYPE)
+        save_trajectory(self.path, columns(self.kind, frames, events), self.fmt)
+
+        self.chunks = []
+        self.closed = True
+
+
+""" Columns """
+def columns(kind, frames, events):
+    """ column dict of FRAME_DTYPE frames and EVENT_DTYPE events """
+    return {
+        'time': frames['time'],
+        'state': frames['state'],
+        'leds': frames['leds'],
+        'touching': frames['touching'],
+        'event_type': events['type'],
+        'event_time': events['time'],
+        'kind': np.array(kind, dtype='u1'),
+    }
+
+
+def touching_points(leds, stick_height):
+    """
+    Vectorized Tracker.update_touching_point: extends the top -> bottom
+    LED segment by stick_height, NaN where both LEDs overlap
+    """
+    top, bottom = leds[:, 0, :2].astype(float), leds[:, 1, :2].astype(float)
+    direction = bottom - top
+    magnitude = np.hypot(direction[:, 0], direction[:, 1])[:, np.newaxis]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.trunc(bottom + direction * stick_height / magnitude).astype('<f4')
+
+
+def from_records(kind, records, stick_height=None):
+    """
+    Column dict of a session_log RECORD_DTYPE array
+    Session logs do not store the touching point, it is estimated from
+    the LEDs when stick_height is given (NaN otherwise)
+    """
+    is_frame = records['type'] == session_log.FRAME
+    frames, events = records[is_frame], records[~is_frame]
+
+    touching = np.full((len(frames), 2), np.nan, dtype='<f4')
+    if stick_height is not None and len(frames):
+        touching = touching_points(frames['points'], stick_height)
+
+    return {
+        'time': np.array(frames['time']),
+        'state': np.array(frames['state']),
+        'leds': np.array(frames['points']),
+        'touching': touching,
+        'event_type': np.array(events['type']),
+        'event_time': np.array(events['time']),
+        'kind': np.array(kind, dtype='u1'),
+    }
+
+
+""" I/O """
+def save_trajectory(path, columns, fmt='npy'):
+    if fmt == 'npz':
+        np.savez(path, **columns)
+        return
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    for (name, column) in columns.items():
+        np.save(os.path.join(path, name + '.npy'), column)
+
+
+def load_trajectory(path, mmap=True):
+    """
+    Column dict of a .traj directory (memory-mapped unless mmap is False)
+    or a .npz archive (always loaded in memory)
+    """
+    if os.path.isdir(path):
+        return dict(
+            (f[:-len('.npy')], np.load(os.path.join(path, f), mmap_mode='r' if mmap else None))
+            for f in os.listdir(path) if f.endswith('.npy'))
+
+    with np.load(path) as archive:
+        return dict((name, archive[name]) for name in archive.files)
+
+
+def convert(path, fmt='npy', stick_height=None):
+    """ Exports a .test or .hsl session log, returns (target path, frames) """
+    if path.endswith('.hsl'):
+        kind, start, records, index = session_log.read_session_log(path)
+    else:
+        kind, records = session_log.read_text_log(path)
+
+    data = from_records(kind, records, stick_height)
+    target = os.path.splitext(path[:-len('.gz')] if path.endswith('.gz') else path)[0] + EXTENSIONS[fmt]
+    save_trajectory(target, data, fmt)
+
+    return target, len(data['time'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exports session logs as columnar trajectories")
+    parser.add_argument('logs', nargs='+', help=".test or .hsl session logs")
+    parser.add_argument('--format', choices=FORMATS, default='npy',
+        help="a .traj directory of .npy columns or a single .npz archive")
+    parser.add_argument('--stick-height', type=float, default=None,
+        help="estimates touching points with this stick height")
+    args = parser.parse_args()
+
+    for path in args.logs:
+        target, frames = convert(path, args.format, args.stick_height)
+        sys.stdout.write("%s -> %s (%d frames)\n" % (path, target, frames))
+
+main() if __name__ == '__main__' else True